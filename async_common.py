@@ -0,0 +1,331 @@
+import json
+import time
+import asyncio
+import logging
+import aiohttp
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from common import (generic_connector, dynamics_connector, TokenProvider, DocumentBuffer, DocumentTooLarge,
+    CircuitOpenError, FetchResult, contentDigest, parseRetryAfter, THROTTLE_STATUS_CODES, DOWNLOAD_CHUNK_BYTES,
+    RETRYABLE_SOURCE_STATUS_CODES, RETRYABLE_SOURCE_EXCEPTIONS)
+
+# Source requests an async connector keeps in flight, which also sizes its
+# HTTP connection pool
+DEFAULT_MAX_IN_FLIGHT = 256
+
+# asyncio variants of the connectors in common.py. Everything that talks to
+# the source runs on one event loop with one aiohttp client: the access
+# token, listings and downloads, so a single process can keep thousands of
+# requests in flight without a thread each. Uploads stay on the thread pool
+# of BatchUploader, which calls the synchronous boto3 client; documents are
+# handed to it with addDocument. Checkpoints, hash cache, transformers and
+# metrics are the ones of generic_connector.
+#
+# get_docs is a coroutine. run() opens the HTTP client and awaits it:
+#
+#   asyncio.run(connector.run())
+
+async def iterate(items):
+    # Iterates items whether it is a plain or an async iterable
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+class AsyncTokenProvider(TokenProvider):
+    # TokenProvider for a coroutine fetch. Callers await getToken(), and
+    # concurrent callers wait for a single refresh.
+    def __init__(self, fetch, refreshMargin, metrics=None):
+        super().__init__(fetch, refreshMargin, metrics)
+        self.asyncLock = asyncio.Lock()
+
+    async def getToken(self):
+        async with self.asyncLock:
+            if self.token is None or time.monotonic() >= self.refreshAt:
+                self.metrics.increment("token.refreshes")
+                with self.metrics.timer("token"):
+                    result = await self.fetch()
+                self._store(result)
+            return self.token
+
+async def admit(policy, url):
+    # SourcePolicy.admit without blocking the event loop
+    attempt = 0
+    while True:
+        try:
+            return attempt, policy.check(url)
+        except CircuitOpenError as e:
+            delay = policy.circuitDelay(e, attempt)
+            if delay is None:
+                raise
+            policy.metrics.increment("source.retries")
+            logging.debug(f"Waiting {delay:.1f} seconds for the circuit of {e.host} to close.")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+async def callWithPolicy(policy, url, send, idempotent=False):
+    # SourcePolicy.call for a coroutine send()
+    attempt, probe = await admit(policy, url)
+    try:
+        while True:
+            try:
+                result = await send()
+            except Exception as e:
+                delay = policy.retryDelay(url, attempt, error=e, idempotent=idempotent)
+                if delay is None:
+                    raise
+                policy.metrics.increment("source.retries")
+                logging.warning(f"Request to {url} failed, retrying in {delay:.1f} seconds: {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            policy.succeeded(url)
+            return result
+    finally:
+        policy.release(url, probe)
+
+class async_generic_connector(generic_connector):
+    retryableExceptions = RETRYABLE_SOURCE_EXCEPTIONS + (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+
+    def __init__(self, config, q_business, resources=None):
+        super().__init__(config, q_business, resources)
+        if self.s3Bucket:
+            raise ValueError("Async connectors do not stage documents in S3, unset s3_bucket or use the threaded connector.")
+        self.maxInFlight = int(config.get('max_in_flight') or DEFAULT_MAX_IN_FLIGHT)
+        self.tokenProvider = AsyncTokenProvider(self.getAccessToken,
+            self.tokenProvider.refreshMargin, self.metrics)
+        self.client = None
+
+    async def run(self):
+        # Opens the aiohttp client, which has to happen on the running event
+        # loop, and runs get_docs with it
+        timeout = aiohttp.ClientTimeout(sock_connect=self.httpTimeout[0], sock_read=self.httpTimeout[1])
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.maxInFlight),
+                timeout=timeout, raise_for_status=False) as self.client:
+            await self.get_docs()
+
+    async def get_docs(self):
+        raise NotImplementedError
+
+    async def addDocument(self, batcher, document):
+        # DocumentBatcher.add blocks while the upload queue is full, so it runs
+        # off the event loop
+        await asyncio.to_thread(batcher.add, document)
+
+    async def callSourceAPI(self, access_token, url, addHeaders):
+        return await self.sourceRequest(access_token, url, addHeaders, read=lambda response: response.read())
+
+    async def sourceRequest(self, access_token, url, addHeaders, read=None):
+        # Same retries and source policy as generic_connector.sourceRequest.
+        # Returns the response with its body unread; use it with async with
+        # so the connection goes back to the pool. With read, the coroutine
+        # read(response) reads the body as part of the request and its result
+        # is returned instead.
+        tokenRefreshed = False
+        throttleAttempts = 0
+        attempt, probe = await admit(self.sourcePolicy, url)
+        try:
+            while True:
+                headers = {"Authorization": "Bearer "+access_token}
+                headers.update(addHeaders)
+                try:
+                    with self.metrics.timer("source.wait"):
+                        while wait := self.rateLimiter.tryAcquire():
+                            await asyncio.sleep(wait)
+                    with self.metrics.timer("source.request"):
+                        response = await self.client.get(url, headers=headers)
+                except Exception as e:
+                    delay = self.sourcePolicy.retryDelay(url, attempt, error=e)
+                    if delay is None:
+                        raise
+                    self.sourceRetry(url, e, delay)
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self.metrics.increment("source.requests")
+                if response.status == 401 and not tokenRefreshed:
+                    self.metrics.increment("source.unauthorized")
+                    self.sourcePolicy.succeeded(url)
+                    response.release()
+                    logging.info("Source rejected the access token, refreshing it.")
+                    self.tokenProvider.invalidate(access_token)
+                    access_token = await self.tokenProvider.getToken()
+                    tokenRefreshed = True
+                    continue
+                if response.status in THROTTLE_STATUS_CODES and throttleAttempts < self.throttleRetries:
+                    throttleAttempts += 1
+                    self.metrics.increment("source.throttles")
+                    response.release()
+                    logging.warning(f"Source returned HTTP {response.status} for {url}, retrying.")
+                    self.rateLimiter.backoff(parseRetryAfter(response.headers.get('Retry-After')))
+                    continue
+                if response.status in RETRYABLE_SOURCE_STATUS_CODES:
+                    delay = self.sourcePolicy.retryDelay(url, attempt, status=response.status,
+                        retryAfter=parseRetryAfter(response.headers.get('Retry-After')))
+                    if delay is not None:
+                        response.release()
+                        self.sourceRetry(url, f"HTTP {response.status}", delay)
+                        await asyncio.sleep(delay)
+                        attempt += 1
+                        continue
+                elif not response.ok:
+                    self.sourcePolicy.succeeded(url)
+                if not response.ok:
+                    response.release()
+                    response.raise_for_status()
+                result = response
+                if read is not None:
+                    try:
+                        async with response:
+                            result = await read(response)
+                    except Exception as e:
+                        delay = self.sourcePolicy.retryDelay(url, attempt, error=e)
+                        if delay is None:
+                            raise
+                        self.sourceRetry(url, e, delay)
+                        await asyncio.sleep(delay)
+                        attempt += 1
+                        continue
+                self.sourcePolicy.succeeded(url)
+                self.rateLimiter.recover()
+                return result
+        finally:
+            self.sourcePolicy.release(url, probe)
+
+    async def fetchDocuments(self, items, addHeaders={}, getId=None):
+        # Async generator with the contract of generic_connector.fetchDocuments.
+        # items may be an async iterable such as paginate(). Downloads run as
+        # tasks, at most max_in_flight at a time, and results are yielded in
+        # input order.
+        pending = deque()
+        unchanged = 0
+        try:
+            async for key, url in iterate(items):
+                docId = getId(key) if getId else None
+                pending.append((key, url, asyncio.ensure_future(self._fetch(url, addHeaders, docId))))
+                self.metrics.observe("fetch.queue", len(pending))
+                while len(pending) >= self.maxInFlight or (pending and pending[0][2].done()):
+                    result = await self._fetchResult(*pending.popleft())
+                    if result.content is None and result.error is None:
+                        unchanged += 1
+                    else:
+                        yield self.fetched(result, getId)
+            while pending:
+                result = await self._fetchResult(*pending.popleft())
+                if result.content is None and result.error is None:
+                    unchanged += 1
+                else:
+                    yield self.fetched(result, getId)
+        finally:
+            for _, _, task in pending:
+                task.cancel()
+            self.metrics.increment("fetch.unchanged", unchanged)
+            if unchanged:
+                logging.info(f"Skipped {unchanged} documents whose content has not changed.")
+
+    async def _fetchResult(self, key, url, task):
+        try:
+            return FetchResult(key, url, content=await task)
+        except Exception as e:
+            self.metrics.increment("fetch.errors")
+            return FetchResult(key, url, error=e)
+
+    async def _fetch(self, url, addHeaders, docId):
+        with self.metrics.timer("fetch"):
+            return await self._fetchDocument(url, addHeaders, docId)
+
+    async def _fetchDocument(self, url, addHeaders, docId):
+        digest, etag = (None, None) if docId is None or self.fullSync else self.hashCache.get(docId)
+        headers = dict(addHeaders)
+        if etag:
+            headers["If-None-Match"] = etag
+
+        async def read(response):
+            if response.status == 304:
+                self.metrics.increment("fetch.not_modified")
+                return None, digest, etag
+            return *await self._readContent(response, docId or contentDigest(url.encode())), response.headers.get("ETag")
+
+        content, newDigest, newEtag = await self.sourceRequest(await self.tokenProvider.getToken(), url, headers, read=read)
+        if docId is None:
+            return content
+        return self._changedContent(docId, digest, newDigest, newEtag, content)
+
+    async def _readContent(self, response, name):
+        length = response.headers.get("Content-Length")
+        if length and not response.headers.get("Content-Encoding") and int(length) > self.maxDocumentBytes:
+            raise DocumentTooLarge(f"{name} is {length} bytes, more than the {self.maxDocumentBytes} allowed.")
+        buffer = DocumentBuffer(self.maxDocumentBytes, self.spoolBytes)
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_BYTES):
+            buffer.write(chunk)
+        self.metrics.increment("fetch.documents")
+        self.metrics.increment("fetch.bytes", buffer.size)
+        self.metrics.observe("document.bytes", buffer.size)
+        return buffer, buffer.hexdigest()
+
+    async def transformDocuments(self, items):
+        # Async generator with the contract of
+        # generic_connector.transformDocuments. CPU bound stages run on the
+        # process pool, or on a worker thread when inline, so they never
+        # block the event loop.
+        pipeline = self.transformerPipeline
+        if not pipeline.cpuBound:
+            async for key, document in iterate(items):
+                yield self._transformResult(key, document)
+            return
+        if self.transformInline:
+            async for key, document in iterate(items):
+                yield await asyncio.to_thread(self._transformResult, key, document)
+            return
+        executor = ProcessPoolExecutor(max_workers=self.transformWorkers,
+            mp_context=multiprocessing.get_context("spawn"))
+        pending = deque()
+        try:
+            async for key, document in iterate(items):
+                document = document.resolve()
+                pending.append((key, document, asyncio.wrap_future(executor.submit(pipeline, document, key))))
+                while len(pending) >= self.transformWorkers * 2 or (pending and pending[0][2].done()):
+                    yield await self._transformed(*pending.popleft())
+            while pending:
+                yield await self._transformed(*pending.popleft())
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    async def _transformed(self, key, document, future):
+        await asyncio.wait((future,))
+        return self._transformResult(key, document, future)
+
+    async def getAccessToken(self):
+        token_data = {
+            "grant_type": "client_credentials",
+            "client_id": self.config['client_id'],
+            "client_secret": self.config['secret']
+        }
+
+        async def requestToken():
+            async with self.client.post(self.config['token_url'], data=token_data) as token_response:
+                if token_response.status in RETRYABLE_SOURCE_STATUS_CODES:
+                    token_response.raise_for_status()
+                return await token_response.json(content_type=None)
+
+        return await callWithPolicy(self.sourcePolicy, self.config['token_url'], requestToken, idempotent=True)
+
+class async_dynamics_connector(async_generic_connector, dynamics_connector):
+    async def paginate(self, url, query={}, pageSize=None, select=None):
+        # Async generator with the contract of dynamics_connector.paginate
+        url, headers = self.pageRequest(url, query, pageSize, select)
+        while url:
+            with self.metrics.timer("list.page"):
+                content = await self.callSourceAPI(await self.tokenProvider.getToken(), url, headers)
+                page = json.loads(content)
+            self.metrics.increment("list.documents", len(page.get('value', [])))
+            for entity in page.get('value', []):
+                yield entity
+            url = page.get('@odata.nextLink')
+
+    async def getAccessToken(self):
+        # MSAL is synchronous, so the token request runs on a worker thread
+        return await asyncio.to_thread(dynamics_connector.getAccessToken, self)
@@ -1,58 +1,2121 @@
-import msal
-import logging
-import requests
-from urllib.request import Request, urlopen
-
-class generic_connector:
-    def __init__(self, config, q_business):
-        self.config = config
-        self.q_business = q_business
-
-    def uploadDocuments(self, documents):
-        logging.info("---------------")
-        #batchput docs
-        batch_put_document_result = self.q_business.batch_put_document(
-                applicationId= self.config['application_Id'],
-                dataSourceSyncId= self.config['job_execution_id'],
-                indexId= self.config['index_id'],
-                documents = documents
-        )
-        logging.info("Calling batch_put_document for batch.")
-        logging.debug(batch_put_document_result)
-
-    def callSourceAPI(self, access_token, url, addHeaders):
-        req = Request(url)
-        req.add_header("Authorization", "Bearer "+access_token)
-        for k,v in addHeaders.items():
-            req.add_header(k, v)
-        content = urlopen(req).read()
-        return content
-
-    def getAccessToken(self):
-        token_data = {
-            "grant_type": "client_credentials",
-            "client_id": self.config['client_id'], 
-            "client_secret": self.config['secret']
-        }
-        token_response = requests.post(self.config['token_url'], data=token_data)
-        access_token_result = token_response.json()
-        return access_token_result
-
-
-class dynamics_connector(generic_connector):
-    def getAccessToken(self):
-        result = None
-        try:
-            app = msal.ConfidentialClientApplication(
-                self.config["client_id"], authority=self.config["authority"],
-                client_credential=self.config["secret"])
-
-            result = app.acquire_token_silent(self.config["scope"], account=None)
-
-            if not result:
-                logging.info("No suitable token exists in cache. Let's get a new one from Azure AD.")
-                result = app.acquire_token_for_client(scopes=self.config["scope"])
-        except Exception as e:
-            logging.error("Error getting access token.")
-            logging.error(e)
+import io
+import os
+import sys
+import msal
+import json
+import boto3
+import time
+import hashlib
+import shutil
+import sqlite3
+import struct
+import random
+import logging
+import requests
+import tempfile
+import threading
+import multiprocessing
+from boto3.s3.transfer import TransferConfig
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote, urlencode, urlsplit
+
+try:
+    import pypdf
+    # pypdf warns about every malformed file, which pdf_text passes through
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+except ImportError:
+    pypdf = None
+
+DEFAULT_FETCH_WORKERS = 8
+DEFAULT_RATE_LIMIT = 10
+DEFAULT_THROTTLE_RETRIES = 5
+DEFAULT_UPLOAD_WORKERS = 4
+DEFAULT_UPLOAD_RETRIES = 3
+DEFAULT_TOKEN_REFRESH_MARGIN = 300
+DEFAULT_HTTP_CONNECT_TIMEOUT = 10
+DEFAULT_HTTP_READ_TIMEOUT = 60
+DEFAULT_ODATA_PAGE_SIZE = 500
+DEFAULT_S3_THRESHOLD = 5 * 1024 * 1024
+DEFAULT_SPOOL_BYTES = 1024 * 1024
+DEFAULT_BULK_FETCH_SIZE = 20
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+THROTTLE_STATUS_CODES = (429, 503)
+DEFAULT_SOURCE_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+DEFAULT_MAX_RETRY_BACKOFF = 30
+DEFAULT_RETRY_BUDGET = 0.2
+DEFAULT_BREAKER_THRESHOLD = 5
+DEFAULT_BREAKER_RESET_SECONDS = 30
+# Source failures worth retrying: throttling, server errors and timeouts, and
+# connections that could not be made or were dropped. Anything else, such as
+# a 404, fails the request straight away.
+RETRYABLE_SOURCE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+RETRYABLE_SOURCE_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+    ConnectionError, TimeoutError)
+DEFAULT_PROGRESS_SECONDS = 30
+METRICS_NAMESPACE = "QBusinessCustomConnector"
+# Observations kept per histogram for percentiles
+HISTOGRAM_SAMPLES = 1000
+# CloudWatch accepts at most 100 metrics per EMF record
+EMF_MAX_METRICS = 100
+# Status byte of a bulk response frame whose content is the document
+FRAME_OK = 0
+
+# BatchPutDocument accepts at most 10 documents per call. Blobs are base64
+# encoded on the wire, so batch sizes are tracked in encoded bytes.
+MAX_BATCH_DOCUMENTS = 10
+# BatchDeleteDocument sets no maximum; ids are deleted 100 per call, which
+# keeps requests small and a failed call cheap to retry
+MAX_DELETE_BATCH_DOCUMENTS = 100
+MAX_BATCH_BYTES = 10 * 1024 * 1024
+DOCUMENT_OVERHEAD_BYTES = 1024
+# Largest document that still fits in a batch on its own once base64 encoded,
+# and the largest document Q Business accepts through S3.
+MAX_INLINE_DOCUMENT_BYTES = (MAX_BATCH_BYTES - DOCUMENT_OVERHEAD_BYTES) // 4 * 3
+MAX_S3_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+# Errors worth retrying, either raised for the whole BatchPutDocument call or
+# reported per document in failedDocuments.
+RETRYABLE_UPLOAD_EXCEPTIONS = ('ThrottlingException', 'InternalServerException')
+RETRYABLE_DOCUMENT_ERRORS = ('InternalError',)
+
+# Joins a document id and a part number when a transformer splits the
+# document, e.g. manual.txt#part-2
+PART_SEPARATOR = "#part-"
+
+def parseRetryAfter(value):
+    # Retry-After is either a number of seconds or an HTTP date.
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def newHTTPSession(poolSize):
+    # The adapter keeps a separate keep-alive pool of poolSize connections for
+    # every host it talks to, so concurrent fetch workers reuse TCP and TLS
+    # connections instead of opening one per request.
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=poolSize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    return session
+
+class Histogram:
+    # Count, sum and extremes of every observation, plus a uniform sample of
+    # at most HISTOGRAM_SAMPLES of them (reservoir sampling) for percentiles,
+    # so memory stays flat however many documents a run handles.
+    __slots__ = ("count", "total", "min", "max", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.samples = []
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.samples) < HISTOGRAM_SAMPLES:
+            self.samples.append(value)
+        else:
+            i = random.randrange(self.count)
+            if i < HISTOGRAM_SAMPLES:
+                self.samples[i] = value
+
+    def percentile(self, p):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+        }
+
+def metricUnit(name):
+    if name.endswith(".ms"):
+        return "Milliseconds"
+    if name.endswith(".bytes"):
+        return "Bytes"
+    return "Count"
+
+class Metrics:
+    # Counters and histograms shared by every stage of a run. Stages count
+    # events with increment(), record sizes and queue depths with observe()
+    # and time themselves with timer(), which records milliseconds under
+    # <name>.ms. Nothing is written while the run is going except the
+    # rate-limited progress() line; emit() hands a snapshot to each sink
+    # at the end.
+    def __init__(self, sinks=(), dimensions=None, progressSeconds=DEFAULT_PROGRESS_SECONDS):
+        self.sinks = list(sinks)
+        self.dimensions = dimensions or {}
+        self.progressSeconds = progressSeconds
+        self.counters = {}
+        self.histograms = {}
+        self.startedAt = time.monotonic()
+        self.progressAt = self.startedAt
+        self.lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name + ".ms", (time.monotonic() - start) * 1000)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "elapsed_seconds": time.monotonic() - self.startedAt,
+                "counters": dict(self.counters),
+                "histograms": {name: h.summary() for name, h in self.histograms.items()},
+            }
+
+    def progress(self):
+        # One INFO line at most every progressSeconds, in place of logging
+        # every document
+        now = time.monotonic()
+        with self.lock:
+            if now - self.progressAt < self.progressSeconds:
+                return
+            self.progressAt = now
+            counters = dict(self.counters)
+        logging.info(f"Fetched {counters.get('fetch.documents', 0)} documents "
+            f"({counters.get('fetch.bytes', 0) / 1024 / 1024:.1f} MB), "
+            f"uploaded {counters.get('upload.documents', 0)}, "
+            f"failed {counters.get('fetch.errors', 0) + counters.get('upload.failed', 0)} "
+            f"in {now - self.startedAt:.0f} seconds.")
+
+    def emit(self):
+        snapshot = self.snapshot()
+        for sink in self.sinks:
+            sink.emit(snapshot, self.dimensions)
+
+class LogMetricsSink:
+    # Logs the snapshot as a run summary
+    def emit(self, snapshot, dimensions):
+        logging.info(f"Run summary after {snapshot['elapsed_seconds']:.1f} seconds:")
+        for name, value in sorted(snapshot['counters'].items()):
+            logging.info(f"  {name}: {value}")
+        for name, h in sorted(snapshot['histograms'].items()):
+            logging.info(f"  {name}: count={h['count']} p50={h['p50']:.1f} p99={h['p99']:.1f} max={h['max']:.1f}")
+
+class EMFMetricsSink:
+    # Prints the snapshot in CloudWatch Embedded Metric Format. In Lambda,
+    # stdout goes to CloudWatch Logs, which turns these records into metrics
+    # without any PutMetricData calls. Histograms are reported as their
+    # count, p50, p99 and max.
+    def __init__(self, namespace=METRICS_NAMESPACE, stream=None):
+        self.namespace = namespace
+        self.stream = stream
+
+    def emit(self, snapshot, dimensions):
+        values = dict(snapshot['counters'])
+        units = {name: metricUnit(name) for name in values}
+        for name, h in snapshot['histograms'].items():
+            values[name + ".count"] = h['count']
+            units[name + ".count"] = "Count"
+            for stat in ("p50", "p99", "max"):
+                values[f"{name}.{stat}"] = h[stat]
+                units[f"{name}.{stat}"] = metricUnit(name)
+        names = sorted(values)
+        for i in range(0, len(names), EMF_MAX_METRICS):
+            chunk = names[i:i + EMF_MAX_METRICS]
+            record = {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [sorted(dimensions)],
+                        "Metrics": [{"Name": name, "Unit": units[name]} for name in chunk],
+                    }],
+                },
+            }
+            record.update(dimensions)
+            record.update({name: values[name] for name in chunk})
+            print(json.dumps(record), file=self.stream or sys.stdout, flush=True)
+
+def metricsSinks(spec):
+    # Sinks named in a comma separated spec: log, emf or none. By default the
+    # summary is logged, and also written as EMF when running in Lambda.
+    if not spec:
+        return [LogMetricsSink()] + ([EMFMetricsSink()] if os.getenv('AWS_LAMBDA_FUNCTION_NAME') else [])
+    sinks = []
+    for name in (x.strip().lower() for x in spec.split(",")):
+        if name == "log":
+            sinks.append(LogMetricsSink())
+        elif name == "emf":
+            sinks.append(EMFMetricsSink())
+        elif name != "none":
+            raise ValueError(f"Unknown metrics sink {name}.")
+    return sinks
+
+class TokenProvider:
+    # Caches the token returned by fetch() and fetches a new one shortly before
+    # it expires. The lock is held while fetching, so concurrent callers wait
+    # for a single refresh instead of each requesting their own token.
+    def __init__(self, fetch, refreshMargin=DEFAULT_TOKEN_REFRESH_MARGIN, metrics=None):
+        self.fetch = fetch
+        self.refreshMargin = refreshMargin
+        self.metrics = metrics or Metrics()
+        self.token = None
+        self.refreshAt = 0.0
+        self.lock = threading.Lock()
+
+    def getToken(self):
+        with self.lock:
+            if self.token is None or time.monotonic() >= self.refreshAt:
+                self._refresh()
+            return self.token
+
+    def _refresh(self):
+        self.metrics.increment("token.refreshes")
+        with self.metrics.timer("token"):
+            result = self.fetch()
+        self._store(result)
+
+    def _store(self, result):
+        if not result or "access_token" not in result:
+            error = result.get("error_description") or result.get("error") if result else None
+            raise RuntimeError(f"Could not obtain an access token: {error}")
+        expiresIn = float(result.get("expires_in") or 3600)
+        self.token = result["access_token"]
+        self.refreshAt = time.monotonic() + expiresIn - min(self.refreshMargin, expiresIn / 2)
+        logging.info(f"Obtained a new access token, valid for {int(expiresIn)} seconds.")
+
+    def invalidate(self, token):
+        # Only drop the token the caller was rejected with, so a burst of 401s
+        # for the same expired token triggers one refresh.
+        with self.lock:
+            if token == self.token:
+                self.token = None
+
+class RateLimiter:
+    # Token bucket shared by every thread calling the source. Each throttled
+    # response halves the refill rate and pauses the bucket for Retry-After
+    # seconds; each successful call adds back a twentieth of the configured
+    # rate until the limiter is running at full speed again.
+    def __init__(self, rate, burst=None):
+        self.maxRate = float(rate)
+        self.minRate = min(self.maxRate, 0.1)
+        self.rate = self.maxRate
+        self.burst = float(burst or max(1.0, self.maxRate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.pausedUntil = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def tryAcquire(self):
+        # Takes a token and returns 0, or returns how many seconds to wait
+        # before trying again
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self.pausedUntil and self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return max(self.pausedUntil - now, (1 - self.tokens) / self.rate)
+
+    def acquire(self):
+        while True:
+            wait = self.tryAcquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def backoff(self, retryAfter=None):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.minRate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            if retryAfter:
+                self.pausedUntil = max(self.pausedUntil, now + retryAfter)
+            logging.info(f"Source is throttling, reducing request rate to {self.rate:.2f}/s.")
+
+    def recover(self):
+        if self.rate >= self.maxRate:
+            return
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.maxRate, self.rate + self.maxRate / 20)
+
+def errorStatus(error):
+    # HTTP status of a requests or aiohttp error, if it has one
+    status = getattr(error, 'status', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status
+
+class CircuitOpenError(Exception):
+    def __init__(self, host, retryAfter):
+        super().__init__(f"The circuit for {host} is open, not sending requests to it.")
+        self.host = host
+        self.retryAfter = retryAfter
+
+class CircuitBreaker:
+    # Guards one source host. After threshold failures in a row the circuit
+    # opens and requests fail fast with CircuitOpenError for resetSeconds, so
+    # a struggling source is not kept busy with requests that will fail
+    # anyway. Then a single trial request is let through: if it succeeds the
+    # circuit closes, if it fails the circuit opens again, and if it ends
+    # without either, say after throttling, release() lets the next one try.
+    def __init__(self, host, threshold=DEFAULT_BREAKER_THRESHOLD, resetSeconds=DEFAULT_BREAKER_RESET_SECONDS):
+        self.host = host
+        self.threshold = threshold
+        self.resetSeconds = resetSeconds
+        self.failures = 0
+        self.openedAt = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        # Returns a token for release() when the caller is the trial request,
+        # None otherwise
+        with self.lock:
+            if self.openedAt is None:
+                return None
+            remaining = self.openedAt + self.resetSeconds - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(self.host, remaining)
+            if self.probing:
+                raise CircuitOpenError(self.host, min(1.0, self.resetSeconds))
+            self.probing = True
+            return self.openedAt
+
+    def release(self, probe):
+        # A trial that failed has opened the circuit again, possibly with a
+        # newer trial under way, so only the trial of the same opening counts
+        with self.lock:
+            if self.probing and self.openedAt == probe:
+                self.probing = False
+
+    def success(self):
+        with self.lock:
+            if self.openedAt is not None:
+                logging.info(f"Source {self.host} is responding again, closing its circuit.")
+            self.failures = 0
+            self.openedAt = None
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or (self.openedAt is None and self.failures >= self.threshold):
+                logging.warning(f"Source {self.host} failed {self.failures} times in a row, "
+                    f"pausing requests to it for {self.resetSeconds} seconds.")
+                self.openedAt = time.monotonic()
+                self.probing = False
+
+class RetryBudget:
+    # Caps retries at a share of all requests. Each request adds ratio
+    # tokens, each retry takes one, and minimum tokens are there from the
+    # start so a sync can retry before it has made many requests. When the
+    # source fails across the board, retries add at most ratio to the load
+    # instead of multiplying it by the number of attempts.
+    def __init__(self, ratio=DEFAULT_RETRY_BUDGET, minimum=10, maximum=100):
+        self.ratio = ratio
+        self.maximum = max(minimum, maximum)
+        self.tokens = float(minimum)
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.maximum, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class SourcePolicy:
+    # Decides how failed source requests are retried, for every thread or
+    # task of a connector: a CircuitBreaker per host, jittered exponential
+    # backoff and a RetryBudget. Only retryable failures of idempotent
+    # requests are retried. Waiting for an open circuit uses up attempts but
+    # no budget, as it sends nothing to the source.
+    def __init__(self, retries=DEFAULT_SOURCE_RETRIES, backoff=DEFAULT_RETRY_BACKOFF, maxBackoff=DEFAULT_MAX_RETRY_BACKOFF,
+            budget=None, breakerThreshold=DEFAULT_BREAKER_THRESHOLD, breakerResetSeconds=DEFAULT_BREAKER_RESET_SECONDS,
+            retryableExceptions=RETRYABLE_SOURCE_EXCEPTIONS, metrics=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.budget = budget or RetryBudget()
+        self.breakerThreshold = breakerThreshold
+        self.breakerResetSeconds = breakerResetSeconds
+        self.retryableExceptions = retryableExceptions
+        self.metrics = metrics or Metrics()
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def breaker(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(host, self.breakerThreshold, self.breakerResetSeconds)
+            return self.breakers[host]
+
+    def check(self, url):
+        # Raises CircuitOpenError while the host's circuit is open. Called once
+        # per request, before its first attempt; when the request is the
+        # circuit's trial it returns a token the caller hands to release()
+        # once it is done, None otherwise.
+        try:
+            return self.breaker(url).allow()
+        except CircuitOpenError:
+            self.metrics.increment("source.circuit_open")
+            raise
+
+    def release(self, url, probe):
+        # Lets the next request try a circuit whose trial ended without a
+        # success or failure being recorded; a no-op otherwise
+        if probe is not None:
+            self.breaker(url).release(probe)
+
+    def circuitDelay(self, error, attempt):
+        # Seconds to wait for an open circuit before checking it again, or None
+        # once attempts are used up. Waiting sends nothing, so it takes no
+        # budget.
+        if attempt >= self.retries:
+            return None
+        return min(error.retryAfter, self.maxBackoff)
+
+    def succeeded(self, url):
+        self.breaker(url).success()
+        self.budget.deposit()
+
+    def retryable(self, error=None, status=None):
+        if status is None and error is not None:
+            status = errorStatus(error)
+        if status is not None:
+            return status in RETRYABLE_SOURCE_STATUS_CODES
+        return isinstance(error, (CircuitOpenError,) + self.retryableExceptions)
+
+    def retryDelay(self, url, attempt, error=None, status=None, retryAfter=None, idempotent=True):
+        # Records a failed attempt, given as an exception or an HTTP status,
+        # and returns the seconds to wait before the next one, or None when
+        # the request should fail: a fatal error, a request that is not
+        # idempotent, or attempts or budget used up.
+        retryable = self.retryable(error, status)
+        if isinstance(error, CircuitOpenError):
+            return self.circuitDelay(error, attempt)
+        self.budget.deposit()
+        if retryable:
+            self.breaker(url).failure()
+        else:
+            # The host answered, the request itself is at fault
+            self.breaker(url).success()
+        if not retryable or not idempotent or attempt >= self.retries:
+            return None
+        if not self.budget.withdraw():
+            self.metrics.increment("source.budget_exhausted")
+            return None
+        return max(retryAfter or 0, random.uniform(0, min(self.maxBackoff, self.backoff * 2 ** attempt)))
+
+    def admit(self, url):
+        # check() for a request that waits for an open circuit as long as its
+        # attempts allow. Returns the number of attempts spent waiting and
+        # the trial token of check().
+        attempt = 0
+        while True:
+            try:
+                return attempt, self.check(url)
+            except CircuitOpenError as e:
+                delay = self.circuitDelay(e, attempt)
+                if delay is None:
+                    raise
+                self.metrics.increment("source.retries")
+                logging.debug(f"Waiting {delay:.1f} seconds for the circuit of {e.host} to close.")
+                time.sleep(delay)
+                attempt += 1
+
+    def call(self, url, send, idempotent=False):
+        # Runs send() under the policy, for source calls that do not go
+        # through sourceRequest. send() raises on failure.
+        attempt, probe = self.admit(url)
+        try:
+            while True:
+                try:
+                    result = send()
+                except Exception as e:
+                    delay = self.retryDelay(url, attempt, error=e, idempotent=idempotent)
+                    if delay is None:
+                        raise
+                    self.metrics.increment("source.retries")
+                    logging.warning(f"Request to {url} failed, retrying in {delay:.1f} seconds: {e}")
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self.succeeded(url)
+                return result
+        finally:
+            self.release(url, probe)
+
+ATTRIBUTE_VALUE_KEYS = {
+    "string": "stringValue",
+    "stringList": "stringListValue",
+    "long": "longValue",
+    "date": "dateValue",
+}
+
+def attribute(name, kind, value):
+    # One document attribute as a (name, type, value) tuple, see
+    # ATTRIBUTE_VALUE_KEYS for the types. Dates are datetimes, ISO 8601
+    # strings or epoch seconds.
+    if kind == "long":
+        value = int(round(float(value)))
+    elif kind == "date":
+        if isinstance(value, (int, float)):
+            value = datetime.fromtimestamp(value, timezone.utc)
+        elif isinstance(value, str):
+            value = datetime.fromisoformat(value)
+    elif kind == "stringList":
+        value = tuple(str(x) for x in value)
+    elif kind == "string":
+        value = str(value)
+    else:
+        raise ValueError(f"Unknown attribute type {kind}.")
+    return (sys.intern(name), kind, value)
+
+class Document:
+    # A document on its way to BatchPutDocument. content is what the fetch
+    # returned, bytes, a DocumentBuffer or an S3Location, and attributes a
+    # tuple of attribute() tuples that documents with the same attributes
+    # share. The request shape is only built by toRequest() at upload time,
+    # so batches and the upload queue hold one small object per document.
+    __slots__ = ("id", "title", "contentType", "content", "attributes")
+
+    def __init__(self, id, content, title=None, contentType="PDF", attributes=()):
+        self.id = id
+        self.title = title
+        self.contentType = contentType
+        self.content = content
+        self.attributes = attributes
+
+    def replace(self, **changes):
+        document = Document(self.id, self.content, self.title, self.contentType, self.attributes)
+        for name, value in changes.items():
+            setattr(document, name, value)
+        return document
+
+    def size(self):
+        # Approximate number of bytes the document adds to a request, with
+        # blobs base64 encoded
+        if self.content is None or isinstance(self.content, S3Location):
+            return DOCUMENT_OVERHEAD_BYTES
+        return DOCUMENT_OVERHEAD_BYTES + (len(self.content) + 2) // 3 * 4
+
+    def resolve(self):
+        # The document with a DocumentBuffer read into bytes
+        if isinstance(self.content, DocumentBuffer):
+            return self.replace(content=self.content.getvalue())
+        return self
+
+    def toRequest(self):
+        if isinstance(self.content, S3Location):
+            content = {"s3": {"bucket": self.content.bucket, "key": self.content.key}}
+        elif isinstance(self.content, DocumentBuffer):
+            content = {"blob": self.content.getvalue()}
+        else:
+            content = {"blob": self.content}
+        request = {
+            "id": self.id,
+            "contentType": self.contentType,
+            "content": content,
+            "attributes": [{"name": name, "value": {ATTRIBUTE_VALUE_KEYS[kind]: list(value) if kind == "stringList" else value}}
+                for name, kind, value in self.attributes],
+        }
+        if self.title is not None:
+            request["title"] = self.title
+        return request
+
+class DocumentBatcher:
+    # Collects documents and hands them to upload() in batches that respect
+    # both the document-count and the request-size limits. With maxAge set, a
+    # partial batch is also flushed once its first document is that many
+    # seconds old, so a slow source does not hold documents back indefinitely.
+    def __init__(self, upload, maxDocuments=MAX_BATCH_DOCUMENTS, maxBytes=MAX_BATCH_BYTES, maxAge=None, metrics=None):
+        self.upload = upload
+        self.maxDocuments = maxDocuments
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.metrics = metrics or Metrics()
+        self.documents = []
+        self.size = 0
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def add(self, document):
+        size = document.size()
+        batches = []
+        with self.lock:
+            if self.documents and self.size + size > self.maxBytes:
+                batches.append(self._take())
+            self.documents.append(document)
+            self.size += size
+            if len(self.documents) >= self.maxDocuments or self.size >= self.maxBytes:
+                batches.append(self._take())
+            elif self.maxAge and self.timer is None:
+                self.timer = threading.Timer(self.maxAge, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        for batch in batches:
+            self._upload(batch)
+
+    def flush(self):
+        with self.lock:
+            batch = self._take()
+        if batch:
+            self._upload(batch)
+
+    def _upload(self, batch):
+        # With a BatchUploader behind it this blocks while the upload queue is
+        # full, so batch.wait shows how long fetching waits on uploads.
+        with self.metrics.timer("batch.wait"):
+            self.upload(batch)
+
+    def _take(self):
+        if self.documents:
+            self.metrics.observe("batch.documents", len(self.documents))
+            self.metrics.observe("batch.bytes", self.size)
+        batch, self.documents, self.size = self.documents, [], 0
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        return batch
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class CheckpointStore:
+    # Remembers which documents have been ingested, at which version (an ETag,
+    # lastModifiedDateTime or content hash), and named cursors such as a
+    # high-water mark for the next incremental sync. Upload workers write to
+    # the store concurrently, so implementations must be thread-safe.
+    def get(self, docId):
+        raise NotImplementedError
+
+    def putMany(self, items):
+        raise NotImplementedError
+
+    def put(self, docId, version):
+        self.putMany([(docId, version)])
+
+    def remove(self, docIds):
+        raise NotImplementedError
+
+    def ids(self):
+        raise NotImplementedError
+
+    def getCursor(self, name):
+        raise NotImplementedError
+
+    def setCursor(self, name, value):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class MemoryCheckpointStore(CheckpointStore):
+    # Used when no checkpoint_path is configured; every run is a full sync.
+    def __init__(self):
+        self.documents = {}
+        self.cursors = {}
+        self.lock = threading.Lock()
+
+    def get(self, docId):
+        return self.documents.get(docId)
+
+    def putMany(self, items):
+        with self.lock:
+            self.documents.update(items)
+
+    def remove(self, docIds):
+        with self.lock:
+            for docId in docIds:
+                self.documents.pop(docId, None)
+
+    def ids(self):
+        with self.lock:
+            return set(self.documents)
+
+    def getCursor(self, name):
+        return self.cursors.get(name)
+
+    def setCursor(self, name, value):
+        with self.lock:
+            self.cursors[name] = value
+
+class JSONCheckpointStore(MemoryCheckpointStore):
+    # Keeps the checkpoint in memory and writes it to a JSON file when the
+    # store is closed. Suited to small corpora; use SQLite for large ones.
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.documents = data.get('documents', {})
+            self.cursors = data.get('cursors', {})
+
+    def close(self):
+        with self.lock:
+            data = {'documents': self.documents, 'cursors': self.cursors}
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(self.path + '.tmp', self.path)
+
+class SQLiteCheckpointStore(CheckpointStore):
+    # Every write is committed immediately, so an interrupted sync keeps the
+    # progress of all batches uploaded before it stopped. Several stores can
+    # share one database file by using different tables.
+    def __init__(self, path, table='documents'):
+        self.table = table
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, version TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS cursors (name TEXT PRIMARY KEY, value TEXT)")
+
+    def get(self, docId):
+        with self.lock:
+            row = self.connection.execute(f"SELECT version FROM {self.table} WHERE id = ?", (docId,)).fetchone()
+        return row[0] if row else None
+
+    def putMany(self, items):
+        with self.lock, self.connection:
+            self.connection.executemany(f"INSERT OR REPLACE INTO {self.table} (id, version) VALUES (?, ?)", items)
+
+    def remove(self, docIds):
+        with self.lock, self.connection:
+            self.connection.executemany(f"DELETE FROM {self.table} WHERE id = ?", ((docId,) for docId in docIds))
+
+    def ids(self):
+        with self.lock:
+            return {row[0] for row in self.connection.execute(f"SELECT id FROM {self.table}")}
+
+    def getCursor(self, name):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM cursors WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def setCursor(self, name, value):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO cursors (name, value) VALUES (?, ?)", (name, json.dumps(value)))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def openCheckpointStore(path, table='documents'):
+    if not path:
+        return MemoryCheckpointStore()
+    if path.endswith('.json'):
+        if table != 'documents':
+            path = f"{path[:-len('.json')]}.{table}.json"
+        return JSONCheckpointStore(path)
+    return SQLiteCheckpointStore(path, table)
+
+def newDigest():
+    return hashlib.blake2b(digest_size=16)
+
+def contentDigest(content):
+    digest = newDigest()
+    digest.update(content)
+    return digest.hexdigest()
+
+class HashCache:
+    # Remembers, per document id, a digest of the content last uploaded and
+    # the ETag the source served it with. Lets the fetch stage skip documents
+    # whose bytes have not changed, or not download them at all when the
+    # source honours If-None-Match.
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, docId):
+        value = self.store.get(docId)
+        return json.loads(value) if value else (None, None)
+
+    def putMany(self, items):
+        self.store.putMany([(docId, json.dumps([digest, etag])) for docId, digest, etag in items])
+
+    def remove(self, docIds):
+        self.store.remove(docIds)
+
+    def close(self):
+        self.store.close()
+
+class DeadLetterQueue:
+    # JSON lines file of documents that failed for good, one line per failure
+    # with the stage it failed in, the error, whether the error was
+    # retryable and the source record get_docs needs to fetch the document
+    # again. take() hands the entries to a replay, keeping them in a
+    # .replaying file until replayed() so an interrupted replay loses
+    # nothing; documents that fail again are added back to the queue.
+    def __init__(self, path):
+        self.path = path
+        self.replayPath = path + ".replaying"
+        self.lock = threading.Lock()
+
+    def add(self, stage, docId, key, error, retryable):
+        line = json.dumps({
+            "id": docId,
+            "stage": stage,
+            "error": str(error),
+            "errorType": type(error).__name__ if isinstance(error, Exception) else None,
+            "retryable": retryable,
+            "failedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "key": key,
+        }, default=str)
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+    def take(self):
+        # The latest entry per document id
+        with self.lock:
+            if os.path.exists(self.path):
+                with open(self.path) as source, open(self.replayPath, "a") as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(self.path)
+            if not os.path.exists(self.replayPath):
+                return []
+            entries = {}
+            with open(self.replayPath) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries[entry['id']] = entry
+            return list(entries.values())
+
+    def replayed(self):
+        with self.lock:
+            if os.path.exists(self.replayPath):
+                os.remove(self.replayPath)
+
+def documentId(document):
+    return document.id
+
+def uploadErrorCode(error):
+    return (getattr(error, 'response', None) or {}).get('Error', {}).get('Code')
+
+class BatchUploader:
+    # Runs upload(documents) for each submitted batch on a pool of worker
+    # threads, so fetching carries on while earlier batches are in flight.
+    # submit() blocks once two batches per worker are queued, which keeps a
+    # fast source from buffering the whole corpus in memory. Batches that fail
+    # with a retryable error, and documents reported in failedDocuments with a
+    # retryable errorCode, are retried with jittered exponential backoff.
+    # Everything that still fails is collected in failedDocuments and passed
+    # to onFailure, and the documents that were accepted are passed to
+    # onSuccess. itemId maps a
+    # submitted item to the id Q Business reports it under, which lets the
+    # same machinery drive BatchDeleteDocument with plain document ids.
+    # Metrics are recorded under stage, e.g. upload.documents.
+    #
+    # With executor set, uploads run on that shared pool instead of a pool of
+    # their own; workers then only sizes this uploader's share of the queue,
+    # and close() waits for this uploader's batches without shutting the
+    # pool down.
+    #
+    # An exception escaping a batch, e.g. from onSuccess when a checkpoint
+    # write fails, is logged as soon as the batch is done and the first one
+    # is raised again by close(), so the sync does not end as if its
+    # progress had been recorded.
+    def __init__(self, upload, workers=DEFAULT_UPLOAD_WORKERS, retries=DEFAULT_UPLOAD_RETRIES, backoff=1.0, onSuccess=None, itemId=None, metrics=None, stage="upload", executor=None, onFailure=None):
+        self.upload = upload
+        self.onSuccess = onSuccess
+        self.onFailure = onFailure
+        self.itemId = itemId or documentId
+        self.metrics = metrics or Metrics()
+        self.stage = stage
+        self.retries = retries
+        self.backoff = backoff
+        self.sharedExecutor = executor is not None
+        self.executor = executor or ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.lock = threading.Lock()
+        self.futures = set()
+        self.failedDocuments = []
+        self.errors = []
+
+    def submit(self, documents):
+        self.slots.acquire()
+        future = self.executor.submit(self._upload, documents)
+        with self.lock:
+            self.futures.add(future)
+            self.metrics.observe(self.stage + ".queue", len(self.futures))
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        error = None if future.cancelled() else future.exception()
+        with self.lock:
+            self.futures.discard(future)
+            if error is not None:
+                self.errors.append(error)
+        self.slots.release()
+        if error is not None:
+            logging.error(f"{self.stage.capitalize()} batch failed: {error!r}")
+
+    def _upload(self, documents):
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            try:
+                with self.metrics.timer(self.stage):
+                    result = self.upload(documents)
+            except Exception as e:
+                if uploadErrorCode(e) == 'ThrottlingException':
+                    self.metrics.increment(self.stage + ".throttles")
+                if uploadErrorCode(e) in RETRYABLE_UPLOAD_EXCEPTIONS and attempt < self.retries:
+                    self.metrics.increment(self.stage + ".retries")
+                    logging.warning(f"Upload of {len(documents)} documents failed, retrying: {e}")
+                    continue
+                logging.error(f"Upload of {len(documents)} documents failed: {e}")
+                self._failed([{"id": self.itemId(d), "error": {"errorCode": uploadErrorCode(e), "errorMessage": str(e)}} for d in documents])
+                return
+            retryIds = set()
+            failedIds = set()
+            for failure in result.get('failedDocuments', []):
+                failedIds.add(failure['id'])
+                error = failure.get('error', {})
+                if error.get('errorCode') in RETRYABLE_DOCUMENT_ERRORS and attempt < self.retries:
+                    retryIds.add(failure['id'])
+                else:
+                    logging.error(f"Document {failure['id']} was rejected: {error.get('errorMessage')}")
+                    self._failed([failure])
+            self.metrics.increment(self.stage + ".documents", len(documents) - len(failedIds))
+            if self.onSuccess:
+                self.onSuccess([d for d in documents if self.itemId(d) not in failedIds])
+            self.metrics.progress()
+            documents = [d for d in documents if self.itemId(d) in retryIds]
+            if not documents:
+                return
+            self.metrics.increment(self.stage + ".retries")
+            logging.warning(f"Retrying {len(documents)} documents reported in failedDocuments.")
+
+    def _failed(self, failures):
+        self.metrics.increment(self.stage + ".failed", len(failures))
+        with self.lock:
+            self.failedDocuments.extend(failures)
+        if self.onFailure:
+            self.onFailure(failures)
+
+    def close(self):
+        if self.sharedExecutor:
+            with self.lock:
+                futures = list(self.futures)
+            wait(futures)
+        else:
+            self.executor.shutdown(wait=True)
+        if self.failedDocuments:
+            logging.error(f"{len(self.failedDocuments)} documents could not be processed.")
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class S3Location:
+    # Where a document too large to send inline was staged in S3.
+    __slots__ = ("bucket", "key", "size")
+
+    def __init__(self, bucket, key, size):
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+
+class DocumentTooLarge(Exception):
+    pass
+
+class DocumentBuffer:
+    # Holds a download as it arrives, keeping its length and digest up to
+    # date chunk by chunk and raising DocumentTooLarge as soon as it passes
+    # maxBytes. Content stays in one bytearray, which is handed to botocore as
+    # the blob without another copy, until it grows past spoolBytes; from then
+    # on it is kept in a temporary file and only read back at upload time.
+    def __init__(self, maxBytes=None, spoolBytes=DEFAULT_SPOOL_BYTES):
+        self.maxBytes = maxBytes
+        self.spoolBytes = spoolBytes
+        self.data = bytearray()
+        self.file = None
+        self.size = 0
+        self.digest = newDigest()
+
+    def count(self, chunk):
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        if self.maxBytes and self.size > self.maxBytes:
+            raise DocumentTooLarge(f"Document is larger than {self.maxBytes} bytes.")
+
+    def write(self, chunk):
+        self.count(chunk)
+        if self.file is None and self.size > self.spoolBytes:
+            self.file = tempfile.TemporaryFile()
+            self.file.write(self.data)
+            self.data = None
+        if self.file is None:
+            self.data += chunk
+        else:
+            self.file.write(chunk)
+
+    def readAt(self, position, size):
+        if self.file is None:
+            return bytes(self.data[position:position + size])
+        self.file.seek(position)
+        return self.file.read(size)
+
+    def getvalue(self):
+        if self.file is None:
+            return self.data
+        self.file.seek(0)
+        return self.file.read()
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+    def __len__(self):
+        return self.size
+
+class BufferReader:
+    # File-like view of a DocumentBuffer for upload_fileobj. read(n) always
+    # returns n bytes until the end, as multipart uploads expect.
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.position = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.buffer.size - self.position
+        chunk = self.buffer.readAt(self.position, size)
+        self.position += len(chunk)
+        return chunk
+
+class FrameReader:
+    # Splits a bulk response into length-prefixed frames: a 4 byte name
+    # length, the UTF-8 name, a status byte and an 8 byte content length, all
+    # big-endian, followed by the content. Content is handed out as
+    # memoryview slices of the chunks read off the socket, so splitting the
+    # stream copies nothing; whatever a caller leaves unread of a frame is
+    # skipped before the next one.
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = memoryview(b"")
+
+    def _fill(self):
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return False
+            self.pending = memoryview(chunk)
+        return True
+
+    def _take(self, size):
+        if not self._fill():
+            raise ValueError("Bulk response ended in the middle of a frame.")
+        chunk, self.pending = self.pending[:size], self.pending[size:]
+        return chunk
+
+    def _read(self, size):
+        data = bytearray()
+        while len(data) < size:
+            data += self._take(size - len(data))
+        return bytes(data)
+
+    def _content(self, size):
+        while size:
+            chunk = self._take(min(size, DOWNLOAD_CHUNK_BYTES))
+            size -= len(chunk)
+            yield chunk
+
+    def __iter__(self):
+        while self._fill():
+            nameLength, = struct.unpack(">I", self._read(4))
+            name = self._read(nameLength).decode()
+            status, size = struct.unpack(">BQ", self._read(9))
+            content = self._content(size)
+            yield name, status, size, content
+            for _ in content:
+                pass
+
+class FetchResult:
+    __slots__ = ("key", "url", "content", "error")
+
+    def __init__(self, key, url, content=None, error=None):
+        self.key = key
+        self.url = url
+        self.content = content
+        self.error = error
+
+class TransformResult:
+    __slots__ = ("key", "documents", "error")
+
+    def __init__(self, key, documents=(), error=None):
+        self.key = key
+        self.documents = documents
+        self.error = error
+
+def partParent(docId):
+    return docId.split(PART_SEPARATOR, 1)[0]
+
+def partNumber(docId):
+    # The n of a <id>#part-<n> id, 0 for a document that is not a part
+    parent, _, number = docId.partition(PART_SEPARATOR)
+    return int(number) if number.isdigit() else 0
+
+def partIds(docId, first, last):
+    return [f"{docId}{PART_SEPARATOR}{n}" for n in range(first, last + 1)]
+
+TRANSFORMERS = {}
+
+def registerTransformer(cls):
+    # Makes a Transformer class available under its name to the transformers
+    # setting of connectors
+    TRANSFORMERS[cls.name] = cls
+    return cls
+
+class TransformMetrics:
+    # The counters of a Transformer. Unlike Metrics they hold no lock or
+    # sinks, so they pickle along with the transformer into a process pool.
+    def __init__(self):
+        self.counters = {}
+
+    def increment(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def take(self):
+        counters, self.counters = self.counters, {}
+        return counters
+
+class Transformer:
+    # One step of the stage between fetch and batch. transform() gets a
+    # Document and the source record it was fetched for, and
+    # returns the documents to upload in its place: usually just the one,
+    # several when it is split, none to drop it.
+    #
+    # Transformers marked cpuBound make the whole stage run in a process pool
+    # so they do not hold the GIL against the download and upload threads.
+    # Transformers and their options are therefore pickled, and transform()
+    # must not rely on connector state.
+    #
+    # Transformers count events with self.metrics.increment(); the counts
+    # come back with the pipeline's results and are added to the connector's
+    # Metrics.
+    name = None
+    cpuBound = False
+
+    def __init__(self, **options):
+        self.options = options
+        self.metrics = TransformMetrics()
+
+    def transform(self, document, record):
+        raise NotImplementedError
+
+@registerTransformer
+class AttributeMapper(Transformer):
+    # Adds document attributes. static maps attribute names to fixed string
+    # values, fields maps them to a record field or a (field, type) pair.
+    # Fields the record does not have are left out, and so are values that do
+    # not convert to their type, which are logged and counted under
+    # transform.attribute_errors.
+    #
+    #   ("attributes", {"static": {"_category": "Invoices"},
+    #                   "fields": {"_last_updated_at": ("modified", "date")}})
+    name = "attributes"
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        # Built once, so every document shares the same tuple
+        self.static = tuple(attribute(name, "string", value) for name, value in (options.get('static') or {}).items())
+        self.fields = [(name, *((field, "string") if isinstance(field, str) else field))
+            for name, field in (options.get('fields') or {}).items()]
+
+    def transform(self, document, record):
+        attributes = document.attributes + self.static if document.attributes else self.static
+        if self.fields and isinstance(record, dict):
+            mapped = []
+            for name, field, kind in self.fields:
+                if record.get(field) is None:
+                    continue
+                try:
+                    mapped.append(attribute(name, kind, record[field]))
+                except (TypeError, ValueError) as e:
+                    logging.warning(f"Document {document.id}: skipping attribute {name}, "
+                        f"cannot convert {field} to {kind}: {e}")
+                    self.metrics.increment("transform.attribute_errors")
+            attributes += tuple(mapped)
+        return [document.replace(attributes=attributes)]
+
+@registerTransformer
+class PdfTextExtractor(Transformer):
+    # Replaces inline PDF blobs with their text as PLAIN_TEXT, which is far
+    # smaller and fits more documents in a batch. PDFs without a text layer,
+    # or that pypdf cannot read, are uploaded as they are for Q Business to
+    # parse. Needs pypdf.
+    name = "pdf_text"
+    cpuBound = True
+
+    def __init__(self, **options):
+        if pypdf is None:
+            raise RuntimeError("The pdf_text transformer needs pypdf, install it or remove the transformer.")
+        super().__init__(**options)
+
+    def transform(self, document, record):
+        blob = document.content
+        if document.contentType != 'PDF' or not isinstance(blob, (bytes, bytearray)):
+            return [document]
+        try:
+            reader = pypdf.PdfReader(io.BytesIO(blob))
+            text = "\n".join(page.extract_text() or "" for page in reader.pages).strip()
+        except Exception:
+            # pypdf raises a range of exception types for malformed files
+            return [document]
+        if not text:
+            return [document]
+        return [document.replace(contentType="PLAIN_TEXT", content=text.encode())]
+
+@registerTransformer
+class DocumentSplitter(Transformer):
+    # Splits PLAIN_TEXT documents larger than max_bytes, by default the
+    # largest inline document, into parts with ids <id>#part-<n>. Parts are
+    # cut after a line break where there is one and never inside a UTF-8
+    # character. Other content types are passed through.
+    name = "split"
+    cpuBound = True
+
+    def transform(self, document, record):
+        maxBytes = int(self.options.get('max_bytes') or MAX_INLINE_DOCUMENT_BYTES)
+        blob = document.content
+        if document.contentType != 'PLAIN_TEXT' or not isinstance(blob, (bytes, bytearray)) or len(blob) <= maxBytes:
+            return [document]
+        parts = []
+        start = 0
+        while start < len(blob):
+            end = min(start + maxBytes, len(blob))
+            if end < len(blob):
+                cut = blob.rfind(b"\n", start, end)
+                if cut > start:
+                    end = cut + 1
+                else:
+                    while end > start + 1 and blob[end] & 0xC0 == 0x80:
+                        end -= 1
+            parts.append(blob[start:end])
+            start = end
+        title = document.title or document.id
+        return [document.replace(
+                id=f"{document.id}{PART_SEPARATOR}{n}",
+                title=f"{title} ({n}/{len(parts)})",
+                content=part)
+            for n, part in enumerate(parts, 1)]
+
+def buildTransformers(spec):
+    # Transformers from a list of names, (name, options) pairs or dicts with a
+    # name key and options, or from a string of comma separated names
+    if not spec:
+        return []
+    if isinstance(spec, str):
+        spec = [x.strip() for x in spec.split(",") if x.strip()]
+    transformers = []
+    for item in spec:
+        if isinstance(item, str):
+            name, options = item, {}
+        elif isinstance(item, dict):
+            name, options = item['name'], {k: v for k, v in item.items() if k != 'name'}
+        else:
+            name, options = item
+        if name not in TRANSFORMERS:
+            raise ValueError(f"Unknown transformer {name}, expected one of {', '.join(sorted(TRANSFORMERS))}.")
+        transformers.append(TRANSFORMERS[name](**options))
+    return transformers
+
+class TransformerPipeline:
+    # Runs transformers in order over a document. Called with (document,
+    # record) it returns the resulting documents, the seconds taken and the
+    # counters the transformers incremented; it is picklable so a process
+    # pool can run it.
+    def __init__(self, transformers):
+        self.transformers = transformers
+        self.cpuBound = any(x.cpuBound for x in transformers)
+
+    def __call__(self, document, record):
+        start = time.monotonic()
+        if self.cpuBound:
+            document = document.resolve()
+        documents = [document]
+        counters = {}
+        for transformer in self.transformers:
+            # Drops what a failed earlier call left behind
+            transformer.metrics.take()
+            documents = [x for d in documents for x in transformer.transform(d, record)]
+            for name, value in transformer.metrics.take().items():
+                counters[name] = counters.get(name, 0) + value
+        return documents, time.monotonic() - start, counters
+
+class SharedResources:
+    # Resources several connectors in one process can share: one HTTP session
+    # with its connection pools, one TokenProvider per set of credentials and
+    # one pool of upload threads. Connectors given a SharedResources use these
+    # instead of creating their own, and leave closing them to its close().
+    def __init__(self, httpPoolSize=DEFAULT_FETCH_WORKERS, uploadWorkers=DEFAULT_UPLOAD_WORKERS):
+        self.session = newHTTPSession(httpPoolSize)
+        self.uploadExecutor = ThreadPoolExecutor(max_workers=uploadWorkers, thread_name_prefix="upload")
+        self.tokenProviders = {}
+        self.lock = threading.Lock()
+
+    def tokenProvider(self, key, fetch, refreshMargin=DEFAULT_TOKEN_REFRESH_MARGIN, metrics=None):
+        with self.lock:
+            if key not in self.tokenProviders:
+                self.tokenProviders[key] = TokenProvider(fetch, refreshMargin, metrics)
+            return self.tokenProviders[key]
+
+    def close(self):
+        self.uploadExecutor.shutdown(wait=True)
+        self.session.close()
+
+class generic_connector:
+    # Transformers every document of this connector goes through, as accepted
+    # by buildTransformers; the transformers setting adds more after these.
+    transformers = []
+    # Exceptions of the HTTP client the source policy retries
+    retryableExceptions = RETRYABLE_SOURCE_EXCEPTIONS
+
+    def __init__(self, config, q_business, resources=None):
+        self.config = config
+        self.q_business = q_business
+        self.resources = resources
+        self.fetchWorkers = int(config.get('fetch_workers') or DEFAULT_FETCH_WORKERS)
+        self.throttleRetries = int(config.get('throttle_retries') or DEFAULT_THROTTLE_RETRIES)
+        self.rateLimiter = RateLimiter(
+            float(config.get('rate_limit') or DEFAULT_RATE_LIMIT),
+            config.get('rate_burst'))
+        self.httpTimeout = (
+            float(config.get('http_connect_timeout') or DEFAULT_HTTP_CONNECT_TIMEOUT),
+            float(config.get('http_read_timeout') or DEFAULT_HTTP_READ_TIMEOUT))
+        self.metrics = Metrics(metricsSinks(config.get('metrics_sinks')),
+            {"DataSourceId": config.get('data_source_id') or "unknown"},
+            float(config.get('progress_seconds') or DEFAULT_PROGRESS_SECONDS))
+        self.sourcePolicy = SourcePolicy(
+            retries=int(config.get('source_retries') or DEFAULT_SOURCE_RETRIES),
+            backoff=float(config.get('retry_backoff') or DEFAULT_RETRY_BACKOFF),
+            maxBackoff=float(config.get('retry_max_backoff') or DEFAULT_MAX_RETRY_BACKOFF),
+            budget=RetryBudget(float(config.get('retry_budget') or DEFAULT_RETRY_BUDGET)),
+            breakerThreshold=int(config.get('breaker_threshold') or DEFAULT_BREAKER_THRESHOLD),
+            breakerResetSeconds=float(config.get('breaker_reset_seconds') or DEFAULT_BREAKER_RESET_SECONDS),
+            retryableExceptions=self.retryableExceptions,
+            metrics=self.metrics)
+        # Documents that fail for good are written to dead_letter_path, and
+        # with replay_dead_letters set get_docs fetches just those again
+        self.deadLetters = DeadLetterQueue(config['dead_letter_path']) if config.get('dead_letter_path') else None
+        self.replay = str(config.get('replay_dead_letters') or '').lower() in ('1', 'true', 'yes')
+        if self.replay and self.deadLetters is None:
+            raise ValueError("replay_dead_letters needs a dead_letter_path.")
+        refreshMargin = float(config.get('token_refresh_margin') or DEFAULT_TOKEN_REFRESH_MARGIN)
+        if resources:
+            self.session = resources.session
+            self.tokenProvider = resources.tokenProvider(self.tokenCacheKey(), self.getAccessToken, refreshMargin, self.metrics)
+        else:
+            self.session = newHTTPSession(int(config.get('http_pool_size') or self.fetchWorkers))
+            self.tokenProvider = TokenProvider(self.getAccessToken, refreshMargin, self.metrics)
+        self.checkpoints = openCheckpointStore(config.get('checkpoint_path'))
+        self.hashCache = HashCache(openCheckpointStore(config.get('checkpoint_path'), 'hashes'))
+        # Number of parts each split document was last uploaded in, so parts
+        # it no longer has are deleted when it shrinks
+        self.partCounts = openCheckpointStore(config.get('checkpoint_path'), 'parts')
+        self.fullSync = str(config.get('full_sync') or '').lower() in ('1', 'true', 'yes')
+        self.s3Bucket = config.get('s3_bucket')
+        # Without roleArn every batch with a staged document would be
+        # rejected as a whole, inline documents included
+        if self.s3Bucket and not config.get('s3_role_arn'):
+            raise ValueError("s3_bucket needs an s3_role_arn for Q Business to read staged documents with.")
+        self.s3Prefix = config.get('s3_prefix') or ''
+        self.s3Threshold = int(config.get('s3_threshold') or DEFAULT_S3_THRESHOLD)
+        self.s3 = boto3.client('s3') if self.s3Bucket else None
+        maxDocumentBytes = MAX_S3_DOCUMENT_BYTES if self.s3Bucket else MAX_INLINE_DOCUMENT_BYTES
+        self.maxDocumentBytes = int(config.get('max_document_bytes') or maxDocumentBytes)
+        self.spoolBytes = int(config.get('spool_bytes') or DEFAULT_SPOOL_BYTES)
+        self.bulkFetchSize = int(config.get('bulk_fetch_size') or 0)
+        self.transformerPipeline = TransformerPipeline(
+            buildTransformers(self.transformers) + buildTransformers(config.get('transformers')))
+        self.transformWorkers = int(config.get('transform_workers') or os.cpu_count() or 1)
+        # Lambda has no /dev/shm, which process pools need, so the stage runs
+        # inline there
+        self.transformInline = (str(config.get('transform_inline') or '').lower() in ('1', 'true', 'yes')
+            or bool(os.getenv('AWS_LAMBDA_FUNCTION_NAME')))
+        self.pendingVersions = {}
+        self.pendingParts = {}
+        self.pendingKeys = {}
+        self.pendingHashes = {}
+        self.pendingLock = threading.Lock()
+
+    def close(self):
+        self.checkpoints.close()
+        self.hashCache.close()
+        self.partCounts.close()
+        if not self.resources:
+            self.session.close()
+
+    def tokenCacheKey(self):
+        # Connectors with the same key share one cached token when they run
+        # with SharedResources
+        return (type(self).getAccessToken, self.config.get('token_url'), self.config.get('client_id'))
+
+    def uploadDocuments(self, documents):
+        logging.debug("---------------")
+        #batchput docs
+        # Q Business reads documents staged in S3 with roleArn
+        roleArn = {"roleArn": self.config['s3_role_arn']} if self.config.get('s3_role_arn') else {}
+        documents = [d.toRequest() for d in documents]
+        batch_put_document_result = self.q_business.batch_put_document(
+                applicationId= self.config['application_Id'],
+                dataSourceSyncId= self.config['job_execution_id'],
+                indexId= self.config['index_id'],
+                documents = documents,
+                **roleArn
+        )
+        self.metrics.increment("upload.bytes", sum(len(d['content'].get('blob') or b"") for d in documents))
+        logging.debug("Calling batch_put_document for batch.")
+        logging.debug(batch_put_document_result)
+        return batch_put_document_result
+
+    def deleteDocuments(self, documentIds):
+        batch_delete_document_result = self.q_business.batch_delete_document(
+                applicationId= self.config['application_Id'],
+                dataSourceSyncId= self.config['job_execution_id'],
+                indexId= self.config['index_id'],
+                documents = [{"documentId": documentId} for documentId in documentIds]
+        )
+        logging.debug("Calling batch_delete_document for batch.")
+        logging.debug(batch_delete_document_result)
+        return batch_delete_document_result
+
+    def documentUploader(self):
+        return BatchUploader(self.uploadDocuments,
+            workers=int(self.config.get('upload_workers') or DEFAULT_UPLOAD_WORKERS),
+            retries=int(self.config.get('upload_retries') or DEFAULT_UPLOAD_RETRIES),
+            onSuccess=self.documentsUploaded,
+            onFailure=self.documentsFailed,
+            metrics=self.metrics,
+            executor=self.resources.uploadExecutor if self.resources else None)
+
+    def documentDeleter(self):
+        return BatchUploader(self.deleteDocuments,
+            workers=int(self.config.get('upload_workers') or DEFAULT_UPLOAD_WORKERS),
+            retries=int(self.config.get('upload_retries') or DEFAULT_UPLOAD_RETRIES),
+            onSuccess=self.documentsDeleted,
+            itemId=str,
+            metrics=self.metrics,
+            stage="delete",
+            executor=self.resources.uploadExecutor if self.resources else None)
+
+    def deleteMissingDocuments(self, listedIds):
+        # Deletes documents that were ingested by an earlier sync but are not
+        # in listedIds. listedIds must come from a complete source listing,
+        # otherwise documents that simply were not listed would be removed.
+        # Parts of split documents go with their parent, and parts beyond the
+        # number the parent was last uploaded in are left over from a larger
+        # version whose deletion failed.
+        staleIds = [x for x in self.checkpoints.ids().difference(listedIds)
+            if partParent(x) not in listedIds or partNumber(x) > int(self.partCounts.get(partParent(x)) or 0)]
+        if not staleIds:
+            return
+        logging.info(f"Deleting {len(staleIds)} documents that are no longer in the source.")
+        with self.documentDeleter() as deleter:
+            for i in range(0, len(staleIds), MAX_DELETE_BATCH_DOCUMENTS):
+                deleter.submit(staleIds[i:i + MAX_DELETE_BATCH_DOCUMENTS])
+
+    def documentChanged(self, docId, version):
+        # False when the checkpoint store already has this document at this
+        # version. Otherwise the version is held until the document's batch
+        # is accepted, then committed by documentsUploaded.
+        version = str(version) if version is not None else None
+        if not self.fullSync and version is not None and self.checkpoints.get(docId) == version:
+            return False
+        with self.pendingLock:
+            self.pendingVersions[docId] = version
+        return True
+
+    def documentsUploaded(self, documents):
+        # Parts of a split document are recorded as they are accepted, so a
+        # later deletion finds them, but the version and hash of the document
+        # itself are only committed once its last part is in. A transformed
+        # document that now has fewer parts than it was last uploaded in has
+        # the others deleted then.
+        items = []
+        hashes = []
+        partCounts = []
+        with self.pendingLock:
+            for d in documents:
+                docId = partParent(d.id)
+                parts = self.pendingParts.get(docId)
+                if docId != d.id:
+                    items.append((d.id, self.pendingVersions.get(docId)))
+                    parts[0] -= 1
+                    if parts[0] > 0:
+                        continue
+                items.append((docId, self.pendingVersions.pop(docId, None)))
+                self.pendingKeys.pop(docId, None)
+                if docId in self.pendingHashes:
+                    hashes.append((docId,) + self.pendingHashes.pop(docId))
+                if parts is not None:
+                    del self.pendingParts[docId]
+                    partCounts.append((docId, parts[1]))
+        self.checkpoints.putMany(items)
+        if hashes:
+            self.hashCache.putMany(hashes)
+        if partCounts:
+            self.partsUploaded(partCounts)
+
+    def partsUploaded(self, partCounts):
+        # Records the number of parts of each (docId, parts) pair and deletes
+        # the parts above it. Parts whose deletion fails stay in the
+        # checkpoint, where deleteMissingDocuments finds them on a later sync.
+        staleIds = []
+        for docId, parts in partCounts:
+            previous = int(self.partCounts.get(docId) or 0)
+            if parts == previous:
+                continue
+            if parts:
+                self.partCounts.put(docId, str(parts))
+            else:
+                self.partCounts.remove([docId])
+            staleIds.extend(partIds(docId, parts + 1, previous))
+        for i in range(0, len(staleIds), MAX_DELETE_BATCH_DOCUMENTS):
+            batch = staleIds[i:i + MAX_DELETE_BATCH_DOCUMENTS]
+            try:
+                result = self.deleteDocuments(batch)
+            except Exception as e:
+                logging.error(f"Deleting {len(batch)} parts of documents that shrank failed: {e}")
+                continue
+            failedIds = {x['id'] for x in result.get('failedDocuments', [])}
+            if failedIds:
+                logging.error(f"{len(failedIds)} parts of documents that shrank could not be deleted.")
+            deletedIds = [x for x in batch if x not in failedIds]
+            self.metrics.increment("delete.documents", len(deletedIds))
+            self.documentsDeleted(deletedIds)
+
+    def documentsFailed(self, failures):
+        if self.deadLetters is None:
+            return
+        for failure in failures:
+            with self.pendingLock:
+                key = self.pendingKeys.get(partParent(failure['id']))
+            error = failure.get('error') or {}
+            self.deadLetter("upload", failure['id'], key, f"{error.get('errorCode')}: {error.get('errorMessage')}",
+                error.get('errorCode') in RETRYABLE_DOCUMENT_ERRORS + RETRYABLE_UPLOAD_EXCEPTIONS)
+
+    def deadLetter(self, stage, docId, key, error, retryable):
+        if self.deadLetters is None:
+            return
+        self.metrics.increment("deadletter.documents")
+        self.deadLetters.add(stage, docId, key, error, retryable)
+
+    def deadLetterKeys(self):
+        # Source records of the dead-lettered documents, for get_docs to fetch
+        # in place of a listing when replay_dead_letters is set. Call
+        # deadLetters.replayed() once they have been processed.
+        keys = [x['key'] for x in self.deadLetters.take() if x.get('key') is not None]
+        logging.info(f"Replaying {len(keys)} dead-lettered documents.")
+        return keys
+
+    def fetched(self, result, getId):
+        # Bookkeeping for dead letters on every result fetchDocuments yields
+        if self.deadLetters is None:
+            return result
+        docId = getId(result.key) if getId else result.url
+        if result.error is not None:
+            self.deadLetter("fetch", docId, result.key, result.error, self.sourcePolicy.retryable(result.error))
+        else:
+            with self.pendingLock:
+                self.pendingKeys[docId] = result.key
+        return result
+
+    def documentsDeleted(self, documentIds):
+        self.checkpoints.remove(documentIds)
+        self.hashCache.remove(documentIds)
+        self.partCounts.remove(documentIds)
+
+    def documentBatcher(self, upload=None):
+        maxAge = self.config.get('batch_max_seconds')
+        return DocumentBatcher(upload or self.uploadDocuments,
+            maxDocuments=int(self.config.get('batch_max_documents') or MAX_BATCH_DOCUMENTS),
+            maxBytes=int(self.config.get('batch_max_bytes') or MAX_BATCH_BYTES),
+            maxAge=float(maxAge) if maxAge else None,
+            metrics=self.metrics)
+
+    def callSourceAPI(self, access_token, url, addHeaders):
+        return self.sourceRequest(access_token, url, addHeaders).content
+
+    def sourceRequest(self, access_token, url, addHeaders, stream=False, read=None):
+        # Returns the response itself so callers can look at the status and
+        # headers, or read the body incrementally with stream=True. With read,
+        # the body is read by read(response) as part of the request, so a
+        # connection that drops halfway through is retried like one that fails
+        # outright, and what read returns is returned with the response closed.
+        # A 401 is retried once with a fresh token; 429 and 503 responses are
+        # retried after the rate limiter has backed off. Other retryable
+        # failures, and throttling that outlasts throttle_retries, are retried
+        # as sourcePolicy decides, which can also fail the request with
+        # CircuitOpenError while the source is down.
+        tokenRefreshed = False
+        throttleAttempts = 0
+        # An open circuit fails the request before it takes a rate limit token
+        # or waits for one
+        attempt, probe = self.sourcePolicy.admit(url)
+        try:
+            while True:
+                headers = {"Authorization": "Bearer "+access_token}
+                headers.update(addHeaders)
+                try:
+                    with self.metrics.timer("source.wait"):
+                        self.rateLimiter.acquire()
+                    with self.metrics.timer("source.request"):
+                        response = self.session.get(url, headers=headers, timeout=self.httpTimeout,
+                            stream=stream or read is not None)
+                except Exception as e:
+                    delay = self.sourcePolicy.retryDelay(url, attempt, error=e)
+                    if delay is None:
+                        raise
+                    self.sourceRetry(url, e, delay)
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self.metrics.increment("source.requests")
+                if response.status_code == 401 and not tokenRefreshed:
+                    self.metrics.increment("source.unauthorized")
+                    self.sourcePolicy.succeeded(url)
+                    response.close()
+                    logging.info("Source rejected the access token, refreshing it.")
+                    self.tokenProvider.invalidate(access_token)
+                    access_token = self.tokenProvider.getToken()
+                    tokenRefreshed = True
+                    continue
+                if response.status_code in THROTTLE_STATUS_CODES and throttleAttempts < self.throttleRetries:
+                    throttleAttempts += 1
+                    self.metrics.increment("source.throttles")
+                    response.close()
+                    logging.warning(f"Source returned HTTP {response.status_code} for {url}, retrying.")
+                    self.rateLimiter.backoff(parseRetryAfter(response.headers.get('Retry-After')))
+                    continue
+                if response.status_code in RETRYABLE_SOURCE_STATUS_CODES:
+                    delay = self.sourcePolicy.retryDelay(url, attempt, status=response.status_code,
+                        retryAfter=parseRetryAfter(response.headers.get('Retry-After')))
+                    if delay is not None:
+                        response.close()
+                        self.sourceRetry(url, f"HTTP {response.status_code}", delay)
+                        time.sleep(delay)
+                        attempt += 1
+                        continue
+                elif not response.ok:
+                    # The host answered, the request itself is at fault
+                    self.sourcePolicy.succeeded(url)
+                if not response.ok:
+                    # A streamed response holds its pooled connection until closed
+                    response.close()
+                    response.raise_for_status()
+                result = response
+                if read is not None:
+                    try:
+                        with response:
+                            result = read(response)
+                    except Exception as e:
+                        delay = self.sourcePolicy.retryDelay(url, attempt, error=e)
+                        if delay is None:
+                            raise
+                        self.sourceRetry(url, e, delay)
+                        time.sleep(delay)
+                        attempt += 1
+                        continue
+                self.sourcePolicy.succeeded(url)
+                self.rateLimiter.recover()
+                return result
+        finally:
+            self.sourcePolicy.release(url, probe)
+
+    def sourceRetry(self, url, error, delay):
+        self.metrics.increment("source.retries")
+        if isinstance(error, CircuitOpenError):
+            logging.debug(f"Waiting {delay:.1f} seconds for the circuit of {error.host} to close.")
+        else:
+            logging.warning(f"Request to {url} failed, retrying in {delay:.1f} seconds: {error}")
+
+    def fetchDocuments(self, items, addHeaders={}, getId=None):
+        # Downloads (key, url) pairs on a pool of fetch_workers threads and yields
+        # a FetchResult per item in input order. At most two downloads per worker
+        # are in flight, so items can be a lazy iterator over a large listing.
+        # Per-document errors are returned on the result rather than raised so
+        # the caller decides whether one bad document should abort the sync.
+        # Each download asks tokenProvider for the token, so long syncs pick up
+        # refreshed tokens as they go.
+        #
+        # When getId maps a key to its document id, documents are checked
+        # against the hash cache: the cached ETag is sent as If-None-Match and
+        # documents that come back 304 or with an unchanged digest are not
+        # yielded at all.
+        executor = ThreadPoolExecutor(max_workers=self.fetchWorkers)
+        pending = deque()
+        unchanged = 0
+        try:
+            for key, url in items:
+                docId = getId(key) if getId else None
+                future = executor.submit(self._fetch, url, addHeaders, docId)
+                pending.append((key, url, future))
+                self.metrics.observe("fetch.queue", len(pending))
+                while len(pending) >= self.fetchWorkers * 2 or (pending and pending[0][2].done()):
+                    result = self._fetchResult(*pending.popleft())
+                    if result.content is None and result.error is None:
+                        unchanged += 1
+                    else:
+                        yield self.fetched(result, getId)
+            while pending:
+                result = self._fetchResult(*pending.popleft())
+                if result.content is None and result.error is None:
+                    unchanged += 1
+                else:
+                    yield self.fetched(result, getId)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.metrics.increment("fetch.unchanged", unchanged)
+            if unchanged:
+                logging.info(f"Skipped {unchanged} documents whose content has not changed.")
+
+    def transformDocuments(self, items):
+        # Runs (key, document) pairs through the transformer stage and yields a
+        # TransformResult per pair in input order. With a cpuBound transformer
+        # the stage runs on transform_workers processes with at most two
+        # documents per worker in flight, so items can be fed straight from
+        # fetchDocuments; otherwise, or with transform_inline set, it runs in
+        # the calling thread. Like fetchDocuments, errors are returned on the
+        # result.
+        if not self.transformerPipeline.cpuBound or self.transformInline:
+            for key, document in items:
+                yield self._transformResult(key, document)
+            return
+        executor = ProcessPoolExecutor(max_workers=self.transformWorkers,
+            mp_context=multiprocessing.get_context("spawn"))
+        pending = deque()
+        try:
+            for key, document in items:
+                document = document.resolve()
+                pending.append((key, document, executor.submit(self.transformerPipeline, document, key)))
+                while len(pending) >= self.transformWorkers * 2 or (pending and pending[0][2].done()):
+                    yield self._transformResult(*pending.popleft())
+            while pending:
+                yield self._transformResult(*pending.popleft())
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _transformResult(self, key, document, future=None):
+        try:
+            documents, seconds, counters = future.result() if future else self.transformerPipeline(document, key)
+        except Exception as e:
+            self.metrics.increment("transform.errors")
+            self.deadLetter("transform", document.id, key, e, False)
+            return TransformResult(key, error=e)
+        for name, value in counters.items():
+            self.metrics.increment(name, value)
+        self.metrics.observe("transform.ms", seconds * 1000)
+        self.metrics.increment("transform.documents", len(documents))
+        parts = sum(1 for d in documents if d.id != document.id)
+        with self.pendingLock:
+            # Parts still to be accepted and the number of parts
+            self.pendingParts[document.id] = [parts, parts]
+        if parts:
+            self.metrics.increment("transform.parts", parts)
+        elif not documents:
+            # Dropped documents are done with, as if they had been uploaded
+            self.documentsUploaded([document])
+        return TransformResult(key, documents)
+
+    def _fetch(self, url, addHeaders, docId):
+        with self.metrics.timer("fetch"):
+            return self._fetchDocument(url, addHeaders, docId)
+
+    def _fetchDocument(self, url, addHeaders, docId):
+        digest, etag = (None, None) if docId is None or self.fullSync else self.hashCache.get(docId)
+        headers = dict(addHeaders)
+        if etag:
+            headers["If-None-Match"] = etag
+        name = docId or contentDigest(url.encode())
+
+        def read(response):
+            if response.status_code == 304:
+                self.metrics.increment("fetch.not_modified")
+                return None, digest, etag
+            return *self._readContent(response, name), response.headers.get("ETag")
+
+        content, newDigest, newEtag = self.sourceRequest(self.tokenProvider.getToken(), url, headers, read=read)
+        if docId is not None:
+            content = self._changedContent(docId, digest, newDigest, newEtag, content)
+        return self.staged(name, content)
+
+    def _changedContent(self, docId, digest, newDigest, newEtag, content):
+        with self.pendingLock:
+            self.pendingHashes[docId] = (newDigest, newEtag)
+        if newDigest != digest:
+            return content
+        # Same bytes as the last upload, so there is nothing to send. Record the
+        # document as ingested right away to keep its version and ETag current.
+        self.documentsUploaded([Document(docId, None)])
+        return None
+
+    def _readContent(self, response, name):
+        # Reads the body chunk by chunk into a DocumentBuffer, which hashes it
+        # and enforces max_document_bytes as it arrives
+        length = response.headers.get("Content-Length")
+        if length and not response.headers.get("Content-Encoding") and int(length) > self.maxDocumentBytes:
+            raise DocumentTooLarge(f"{name} is {length} bytes, more than the {self.maxDocumentBytes} allowed.")
+        return self._readBody(response.iter_content(DOWNLOAD_CHUNK_BYTES), name)
+
+    def _readBody(self, body, name):
+        buffer = DocumentBuffer(self.maxDocumentBytes, self.spoolBytes)
+        for chunk in body:
+            buffer.write(chunk)
+        self.metrics.increment("fetch.documents")
+        self.metrics.increment("fetch.bytes", buffer.size)
+        self.metrics.observe("document.bytes", buffer.size)
+        return buffer, buffer.hexdigest()
+
+    def staged(self, name, content):
+        # With s3_bucket configured, content larger than s3_threshold is
+        # staged in S3 and an S3Location returned in its place. This runs
+        # after the digest check, so unchanged documents are never staged.
+        if content is not None and self.s3Bucket and len(content) > self.s3Threshold:
+            return self.stageInS3(name, content)
+        return content
+
+    def stageInS3(self, name, buffer):
+        key = self.s3Prefix + name
+        with self.metrics.timer("s3.upload"):
+            self.s3.upload_fileobj(BufferReader(buffer), self.s3Bucket, key, Config=TransferConfig(
+                multipart_threshold=self.s3Threshold, max_concurrency=2))
+        self.metrics.increment("s3.documents")
+        self.metrics.increment("s3.bytes", buffer.size)
+        logging.debug(f"Staged {name} ({buffer.size} bytes) in s3://{self.s3Bucket}/{key}.")
+        return S3Location(self.s3Bucket, key, buffer.size)
+
+    def callSourceAPIBulk(self, access_token, url, names, addHeaders):
+        # Fetches several documents in one request from a bulk endpoint that
+        # takes repeated name parameters and answers with FrameReader frames.
+        # Yields (name, content, digest, error) per frame; content is read
+        # into a DocumentBuffer exactly like a single download.
+        query = urlencode([("name", name) for name in names])
+        with self.sourceRequest(access_token, f"{url}?{query}", addHeaders, stream=True) as response:
+            for name, status, size, body in FrameReader(response.iter_content(DOWNLOAD_CHUNK_BYTES)):
+                if status != FRAME_OK:
+                    message = b"".join(body).decode(errors="replace")
+                    yield name, None, None, RuntimeError(f"{name}: {message}")
+                    continue
+                try:
+                    if size > self.maxDocumentBytes:
+                        raise DocumentTooLarge(f"{name} is {size} bytes, more than the {self.maxDocumentBytes} allowed.")
+                    content, digest = self._readBody(body, name)
+                except DocumentTooLarge as e:
+                    yield name, None, None, e
+                    continue
+                yield name, content, digest, None
+
+    def fetchDocumentsBulk(self, items, url, addHeaders={}, getId=None, batchSize=None):
+        # Same contract as fetchDocuments for (key, name) pairs, but requests
+        # batchSize documents at a time from a bulk endpoint, so latency bound
+        # sources cost one round trip per batch rather than per document.
+        # Unchanged documents are recognized by digest only, as a bulk
+        # request carries no per-document If-None-Match.
+        batchSize = batchSize or self.bulkFetchSize or DEFAULT_BULK_FETCH_SIZE
+        executor = ThreadPoolExecutor(max_workers=self.fetchWorkers)
+        pending = deque()
+        unchanged = 0
+
+        def results(future):
+            nonlocal unchanged
+            for result in future.result():
+                if result.content is None and result.error is None:
+                    unchanged += 1
+                else:
+                    yield self.fetched(result, getId)
+
+        try:
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) == batchSize:
+                    pending.append(executor.submit(self._fetchBulk, url, batch, addHeaders, getId))
+                    self.metrics.observe("fetch.queue", len(pending))
+                    batch = []
+                while len(pending) >= self.fetchWorkers or (pending and pending[0].done()):
+                    yield from results(pending.popleft())
+            if batch:
+                pending.append(executor.submit(self._fetchBulk, url, batch, addHeaders, getId))
+            while pending:
+                yield from results(pending.popleft())
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.metrics.increment("fetch.unchanged", unchanged)
+            if unchanged:
+                logging.info(f"Skipped {unchanged} documents whose content has not changed.")
+
+    def _fetchBulk(self, url, batch, addHeaders, getId):
+        # FetchResults for one bulk request in batch order. Documents the
+        # response never reached, because it was cut short or left them out,
+        # are reported as errors.
+        fetched = {}
+        requestError = None
+        try:
+            names = [name for key, name in batch]
+            with self.metrics.timer("fetch.bulk"):
+                for name, content, digest, error in self.callSourceAPIBulk(self.tokenProvider.getToken(), url, names, addHeaders):
+                    fetched[name] = (content, digest, error)
+        except Exception as e:
+            requestError = e
+        results = []
+        for key, name in batch:
+            if name not in fetched:
+                error = requestError or KeyError(f"{name} is missing from the bulk response.")
+                self.metrics.increment("fetch.errors")
+                results.append(FetchResult(key, url, error=error))
+                continue
+            content, newDigest, error = fetched[name]
+            if error is not None:
+                self.metrics.increment("fetch.errors")
+            docId = getId(key) if getId else None
+            if error is None and docId is not None:
+                digest, etag = (None, None) if self.fullSync else self.hashCache.get(docId)
+                content = self._changedContent(docId, digest, newDigest, etag if newDigest == digest else None, content)
+            if error is None:
+                try:
+                    content = self.staged(docId or name, content)
+                except Exception as e:
+                    self.metrics.increment("fetch.errors")
+                    content, error = None, e
+            results.append(FetchResult(key, url, content=content, error=error))
+        return results
+
+    def _fetchResult(self, key, url, future):
+        try:
+            return FetchResult(key, url, content=future.result())
+        except Exception as e:
+            self.metrics.increment("fetch.errors")
+            return FetchResult(key, url, error=e)
+
+    def getAccessToken(self):
+        token_data = {
+            "grant_type": "client_credentials",
+            "client_id": self.config['client_id'], 
+            "client_secret": self.config['secret']
+        }
+
+        def requestToken():
+            token_response = self.session.post(self.config['token_url'], data=token_data, timeout=self.httpTimeout)
+            if token_response.status_code in RETRYABLE_SOURCE_STATUS_CODES:
+                token_response.raise_for_status()
+            return token_response.json()
+
+        # A client credentials grant changes nothing on the server, so it is
+        # safe to retry even though it is a POST
+        return self.sourcePolicy.call(self.config['token_url'], requestToken, idempotent=True)
+
+
+class dynamics_connector(generic_connector):
+    def __init__(self, config, q_business, resources=None):
+        super().__init__(config, q_business, resources)
+        self.msalApp = None
+        self.msalLock = threading.Lock()
+
+    def tokenCacheKey(self):
+        return (type(self).getAccessToken, self.config.get('authority'), self.config.get('client_id'), tuple(self.config.get('scope') or ()))
+
+    def getMsalApp(self):
+        # One ConfidentialClientApplication per connector so MSAL's in-memory
+        # token cache survives between calls.
+        with self.msalLock:
+            if self.msalApp is None:
+                self.msalApp = msal.ConfidentialClientApplication(
+                    self.config["client_id"], authority=self.config["authority"],
+                    client_credential=self.config["secret"])
+            return self.msalApp
+
+    def pageRequest(self, url, query={}, pageSize=None, select=None):
+        # URL and headers of the first page of an OData collection
+        query = dict(query)
+        if select:
+            query["$select"] = ",".join(select)
+        if query:
+            url += ("&" if "?" in url else "?") + urlencode(query, quote_via=quote, safe="$,()'")
+        pageSize = pageSize or int(self.config.get('odata_page_size') or DEFAULT_ODATA_PAGE_SIZE)
+        return url, {"Prefer": f"odata.maxpagesize={pageSize}"}
+
+    def paginate(self, url, query={}, pageSize=None, select=None):
+        # Yields the entities of an OData collection one page at a time by
+        # following @odata.nextLink. The page size is requested through the
+        # odata.maxpagesize preference, which Business Central uses for
+        # server-driven paging; $top in query still caps the total returned.
+        url, headers = self.pageRequest(url, query, pageSize, select)
+        while url:
+            with self.metrics.timer("list.page"):
+                content = self.callSourceAPI(self.tokenProvider.getToken(), url, headers)
+                page = json.loads(content)
+            self.metrics.increment("list.documents", len(page.get('value', [])))
+            yield from page.get('value', [])
+            url = page.get('@odata.nextLink')
+
+    def getAccessToken(self):
+        result = None
+        try:
+            app = self.getMsalApp()
+
+            result = app.acquire_token_silent(self.config["scope"], account=None)
+
+            if not result:
+                logging.info("No suitable token exists in cache. Let's get a new one from Azure AD.")
+                result = app.acquire_token_for_client(scopes=self.config["scope"])
+        except Exception as e:
+            logging.error("Error getting access token.")
+            logging.error(e)
         return result
\ No newline at end of file
@@ -1,58 +1,125 @@
-
-import sys
-import logging
-import json
-import time
-sys.path.append("../../")
-from common import dynamics_connector
-
-class salesinvoices(dynamics_connector):
-    def get_docs(self):
-        documents = []
-        salesInvoices = []
-
-        tokenResult = self.getAccessToken()
-
-        salesInvoiceResult = None
-        try:
-            logging.info("Getting sales invoices from Dynamics 365 Business Central.")
-            salesInvoicesURL = f"https://api.businesscentral.dynamics.com/v2.0/production/api/v2.0/companies({self.config['companyid']})/salesInvoices?$expand=pdfDocument"
-            content = self.callSourceAPI(tokenResult["access_token"], salesInvoicesURL, {})
-            salesInvoiceResult = json.loads(content)
-            salesInvoices = salesInvoiceResult['value']
-            logging.info(f"Found {len(salesInvoices)} sales invoices.")
-        except Exception as e:
-            logging.error("Error getting sales invoices from Dynamics 365 Business Central.")
-            logging.error(e)
-            return
-
-        for x in salesInvoices:
-            getPDFFileLink = x['pdfDocument']['pdfDocumentContent@odata.mediaReadLink']
-            content = self.callSourceAPI(tokenResult["access_token"], getPDFFileLink, {})
-            filename = x['number'] + ".pdf"
-            logging.info(f"Adding {filename} to upload batch.")
-            doc = {
-                "id": filename,
-                "contentType":"PDF",
-                "title": filename,
-                "content": {
-                    "blob": content
-                },
-                "attributes": [ 
-                    { 
-                        "name": "_category",
-                        "value": {
-                            "stringValue":"Sales Invoices"
-                        }
-                    }
-                ],
-            }
-            if len(documents) >= 10:
-                self.uploadDocuments(documents)
-                documents = []
-            documents.append(doc)
-            time.sleep(1)
-
-        if len(documents) > 0:
-            self.uploadDocuments(documents)
-            documents = []
\ No newline at end of file
+
+import sys
+import logging
+from datetime import datetime, timezone
+sys.path.append("../../")
+from common import dynamics_connector, Document
+
+LAST_MODIFIED_CURSOR = "salesInvoices.lastModifiedDateTime"
+
+# OData timestamps differ in fractional digits and offsets, so the
+# high-water mark is kept as a datetime and compared as one, and written to
+# the checkpoint in a single canonical UTC form.
+def parseTimestamp(value):
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def formatTimestamp(value):
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds").replace("+00:00", "Z")
+
+def latestTimestamp(latest, value):
+    # The later of a datetime, or None, and an OData timestamp, or None
+    if not value:
+        return latest
+    value = parseTimestamp(value)
+    return value if latest is None or value > latest else latest
+
+# Invoice fields sent as custom attributes with invoice_attributes set.
+# Each must be defined on the index first, with the type given in the README,
+# or Q Business rejects the invoices. The amount is kept as a string so its
+# cents survive.
+CUSTOM_ATTRIBUTE_FIELDS = {
+    "customerNumber": "customerNumber",
+    "customerName": "customerName",
+    "invoiceDate": ("invoiceDate", "date"),
+    "dueDate": ("dueDate", "date"),
+    "totalAmountIncludingTax": "totalAmountIncludingTax",
+    "currencyCode": "currencyCode",
+    "status": "status",
+}
+
+def invoiceTransformers(config):
+    # The attributes transformer for invoices: the reserved _ attributes,
+    # which every index has, plus the custom ones when asked for
+    fields = {
+        "_created_at": ("invoiceDate", "date"),
+        "_last_updated_at": ("lastModifiedDateTime", "date"),
+    }
+    if str(config.get('invoice_attributes') or '').lower() in ('1', 'true', 'yes'):
+        fields.update(CUSTOM_ATTRIBUTE_FIELDS)
+    return [("attributes", {"static": {"_category": "Sales Invoices"}, "fields": fields})]
+
+class salesinvoices(dynamics_connector):
+    def __init__(self, config, q_business, resources=None):
+        self.transformers = invoiceTransformers(config)
+        super().__init__(config, q_business, resources)
+
+    def get_docs(self):
+        logging.info("Getting sales invoices from Dynamics 365 Business Central.")
+        salesInvoicesURL = f"https://api.businesscentral.dynamics.com/v2.0/production/api/v2.0/companies({self.config['companyid']})/salesInvoices"
+        query = {"$expand": "pdfDocument"}
+        # Only ask for invoices modified since the last successful sync.
+        cursor = None if self.fullSync else self.checkpoints.getCursor(LAST_MODIFIED_CURSOR)
+        lastModified = parseTimestamp(cursor) if cursor else None
+        if lastModified:
+            logging.info(f"Getting sales invoices modified after {formatTimestamp(lastModified)}.")
+            query["$filter"] = f"lastModifiedDateTime gt {formatTimestamp(lastModified)}"
+        # Invoices are streamed page by page into the download pool, so only
+        # the current page and the in-flight downloads are held in memory. A
+        # replay fetches the dead-lettered invoices instead.
+        salesInvoices = self.deadLetterKeys() if self.replay else self.paginate(salesInvoicesURL, query)
+        fetchItems = ((x, x['pdfDocument']['pdfDocumentContent@odata.mediaReadLink']) for x in salesInvoices
+            if self.documentChanged(x['number'] + ".pdf", x.get('lastModifiedDateTime')))
+        count = 0
+        errors = 0
+
+        def fetchedDocuments():
+            nonlocal count, errors, lastModified
+            for result in self.fetchDocuments(fetchItems, getId=lambda x: x['number'] + ".pdf"):
+                count += 1
+                filename = result.key['number'] + ".pdf"
+                lastModified = latestTimestamp(lastModified, result.key.get('lastModifiedDateTime'))
+                if result.error:
+                    errors += 1
+                    logging.error(f"Error downloading {filename} from Dynamics 365 Business Central.")
+                    logging.error(result.error)
+                    continue
+                yield result.key, Document(filename, result.content, title=filename)
+
+        try:
+            with self.documentUploader() as uploader, self.documentBatcher(uploader.submit) as documentBatch:
+                for result in self.transformDocuments(fetchedDocuments()):
+                    if result.error:
+                        errors += 1
+                        logging.error(f"Error transforming {result.key['number']}.pdf.")
+                        logging.error(result.error)
+                        continue
+                    for doc in result.documents:
+                        logging.debug(f"Adding {doc.id} to upload batch.")
+                        documentBatch.add(doc)
+        except Exception as e:
+            logging.error("Error getting sales invoices from Dynamics 365 Business Central.")
+            logging.error(e)
+            return
+        logging.info(f"Processed {count} sales invoices.")
+        if self.replay:
+            self.deadLetters.replayed()
+            return
+        # Moving the high-water mark past a failed invoice would skip it on the
+        # next run, so the cursor only advances after a clean sync, or when
+        # failed invoices are kept in the dead-letter file for a replay.
+        if (self.deadLetters is not None or errors == 0 and not uploader.failedDocuments) and lastModified:
+            self.checkpoints.setCursor(LAST_MODIFIED_CURSOR, formatTimestamp(lastModified))
+
+        # An incremental query does not show deleted invoices, so list just the
+        # invoice numbers of the whole collection and remove the ones that
+        # have disappeared since they were ingested.
+        try:
+            listedIds = {x['number'] + ".pdf" for x in self.paginate(salesInvoicesURL, select=["number"])}
+        except Exception as e:
+            logging.error("Error listing sales invoices, skipping deletion of removed invoices.")
+            logging.error(e)
+            return
+        self.deleteMissingDocuments(listedIds)
\ No newline at end of file
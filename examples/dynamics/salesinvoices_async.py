@@ -0,0 +1,85 @@
+import sys
+import logging
+sys.path.append("../../")
+from common import Document
+from async_common import async_dynamics_connector, iterate
+from salesinvoices import invoiceTransformers, LAST_MODIFIED_CURSOR, parseTimestamp, formatTimestamp, latestTimestamp
+
+class salesinvoices_async(async_dynamics_connector):
+    # The salesinvoices connector on asyncio, see async_common.py. Invoice
+    # pages and PDF downloads share one event loop, with downloads limited by
+    # max_in_flight and rate_limit instead of fetch_workers.
+    def __init__(self, config, q_business, resources=None):
+        self.transformers = invoiceTransformers(config)
+        super().__init__(config, q_business, resources)
+
+    async def get_docs(self):
+        logging.info("Getting sales invoices from Dynamics 365 Business Central.")
+        salesInvoicesURL = f"https://api.businesscentral.dynamics.com/v2.0/production/api/v2.0/companies({self.config['companyid']})/salesInvoices"
+        query = {"$expand": "pdfDocument"}
+        # Only ask for invoices modified since the last successful sync.
+        cursor = None if self.fullSync else self.checkpoints.getCursor(LAST_MODIFIED_CURSOR)
+        lastModified = parseTimestamp(cursor) if cursor else None
+        if lastModified:
+            logging.info(f"Getting sales invoices modified after {formatTimestamp(lastModified)}.")
+            query["$filter"] = f"lastModifiedDateTime gt {formatTimestamp(lastModified)}"
+
+        # A replay fetches the dead-lettered invoices instead of the listing
+        salesInvoices = self.deadLetterKeys() if self.replay else self.paginate(salesInvoicesURL, query)
+
+        async def fetchItems():
+            async for x in iterate(salesInvoices):
+                if self.documentChanged(x['number'] + ".pdf", x.get('lastModifiedDateTime')):
+                    yield x, x['pdfDocument']['pdfDocumentContent@odata.mediaReadLink']
+
+        count = 0
+        errors = 0
+
+        async def fetchedDocuments():
+            nonlocal count, errors, lastModified
+            async for result in self.fetchDocuments(fetchItems(), getId=lambda x: x['number'] + ".pdf"):
+                count += 1
+                filename = result.key['number'] + ".pdf"
+                lastModified = latestTimestamp(lastModified, result.key.get('lastModifiedDateTime'))
+                if result.error:
+                    errors += 1
+                    logging.error(f"Error downloading {filename} from Dynamics 365 Business Central.")
+                    logging.error(result.error)
+                    continue
+                yield result.key, Document(filename, result.content, title=filename)
+
+        try:
+            with self.documentUploader() as uploader, self.documentBatcher(uploader.submit) as documentBatch:
+                async for result in self.transformDocuments(fetchedDocuments()):
+                    if result.error:
+                        errors += 1
+                        logging.error(f"Error transforming {result.key['number']}.pdf.")
+                        logging.error(result.error)
+                        continue
+                    for doc in result.documents:
+                        logging.debug(f"Adding {doc.id} to upload batch.")
+                        await self.addDocument(documentBatch, doc)
+        except Exception as e:
+            logging.error("Error getting sales invoices from Dynamics 365 Business Central.")
+            logging.error(e)
+            return
+        logging.info(f"Processed {count} sales invoices.")
+        if self.replay:
+            self.deadLetters.replayed()
+            return
+        # Moving the high-water mark past a failed invoice would skip it on the
+        # next run, so the cursor only advances after a clean sync, or when
+        # failed invoices are kept in the dead-letter file for a replay.
+        if (self.deadLetters is not None or errors == 0 and not uploader.failedDocuments) and lastModified:
+            self.checkpoints.setCursor(LAST_MODIFIED_CURSOR, formatTimestamp(lastModified))
+
+        # An incremental query does not show deleted invoices, so list just the
+        # invoice numbers of the whole collection and remove the ones that
+        # have disappeared since they were ingested.
+        try:
+            listedIds = {x['number'] + ".pdf" async for x in self.paginate(salesInvoicesURL, select=["number"])}
+        except Exception as e:
+            logging.error("Error listing sales invoices, skipping deletion of removed invoices.")
+            logging.error(e)
+            return
+        self.deleteMissingDocuments(listedIds)
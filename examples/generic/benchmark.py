@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import logging
+import argparse
+import resource
+import platform
+import tempfile
+import statistics
+import subprocess
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(HERE, "../../"))
+sys.path.append(HERE)
+from generic import generic
+from fake_qbusiness import FakeQBusiness
+
+# Benchmark of the generic connector end to end: builds a synthetic
+# documents/ corpus, serves it with server.py (optionally with injected
+# latency and errors) and runs generic.get_docs against FakeQBusiness, which
+# can throttle and fail documents as well. Corpus and server settings are derived from the
+# arguments and a fixed seed, so results of different commits are
+# comparable as long as the arguments are the same.
+#
+#   python3 benchmark.py --documents 2000 --sizes lognormal:200000:1.0 \
+#       --latency-ms 20 --config fetch_workers=16 --output results.jsonl
+
+def parseSizes(spec):
+    # fixed:<bytes>, uniform:<min>:<max> or lognormal:<median>:<sigma>
+    kind, *args = spec.split(":")
+    args = [float(x) for x in args]
+    if kind == "fixed" and len(args) == 1:
+        return lambda rng: int(args[0])
+    if kind == "uniform" and len(args) == 2:
+        return lambda rng: int(rng.uniform(args[0], args[1]))
+    if kind == "lognormal" and len(args) == 2:
+        return lambda rng: int(args[0] * rng.lognormvariate(0, args[1]))
+    raise ValueError(f"Invalid size distribution {spec}.")
+
+def generateCorpus(path, count, sizes, seed):
+    # Writes count files of random bytes behind a PDF header and returns
+    # their total size
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    total = 0
+    for i in range(count):
+        size = max(16, sizes(rng))
+        with open(os.path.join(path, f"doc{i:07d}.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4\n")
+            remaining = size - 9
+            while remaining > 0:
+                chunk = min(remaining, 1024 * 1024)
+                f.write(rng.randbytes(chunk))
+                remaining -= chunk
+        total += size
+    return total
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def startServer(workdir, args):
+    # Starts the server on a free port and returns it with its URL. Its
+    # output goes to server.log, which is shown if it does not come up.
+    port = freePort()
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ,
+        MOCK_LATENCY_MS=str(args.latency_ms),
+        MOCK_ERROR_RATE=str(args.error_rate),
+        PORT=str(port))
+    if args.server == "gunicorn":
+        command = ["gunicorn", "--config", os.path.join(HERE, "gunicorn.conf.py"), "--chdir", workdir, "server:app"]
+        shutil.copy(os.path.join(HERE, "server.py"), workdir)
+    else:
+        command = [sys.executable, os.path.join(HERE, "server.py")]
+    logPath = os.path.join(workdir, "server.log")
+    with open(logPath, "wb") as log:
+        server = subprocess.Popen(command, cwd=workdir, env=env,
+            stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            # Another process answering on the port is not our server
+            if requests.get(url, timeout=1).ok and server.poll() is None:
+                return server, url
+        except requests.ConnectionError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.2)
+    server.kill()
+    server.wait()
+    with open(logPath, errors="replace") as log:
+        output = log.read()[-2000:]
+    raise RuntimeError(f"The mock API Server did not start:\n{output}")
+
+class BenchmarkConnector(generic):
+    # Records when each document starts downloading, so per-document latency
+    # covers download, batching and upload.
+    def __init__(self, config, q_business):
+        super().__init__(config, q_business)
+        self.started = {}
+
+    def _fetch(self, url, addHeaders, docId):
+        self.started.setdefault(docId, time.monotonic())
+        return super()._fetch(url, addHeaders, docId)
+
+    def _fetchBulk(self, url, batch, addHeaders, getId):
+        now = time.monotonic()
+        for key, name in batch:
+            self.started.setdefault(getId(key), now)
+        return super()._fetchBulk(url, batch, addHeaders, getId)
+
+def gitRevision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE,
+            capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE,
+            capture_output=True, text=True, check=True).stdout.strip() != ""
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def percentile(values, p):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+def runBenchmark(args):
+    workdir = tempfile.mkdtemp(prefix="connector-benchmark-")
+    try:
+        corpusBytes = generateCorpus(os.path.join(workdir, "documents"),
+            args.documents, parseSizes(args.sizes), args.seed)
+        server, serverURL = startServer(workdir, args)
+        try:
+            q_business = FakeQBusiness(
+                throttleRate=args.throttle_rate,
+                failureRate=args.failure_rate,
+                latency=args.upload_latency_ms / 1000,
+                seed=args.seed)
+            config = {
+                "application_Id": "benchmark",
+                "index_id": "benchmark",
+                "data_source_id": "benchmark",
+                "client_id": "clientid",
+                "secret": "secret",
+                "token_url": f"{serverURL}/oauth/token",
+                "datasource_url": serverURL,
+                "rate_limit": "1000",
+                "metrics_sinks": "none",
+            }
+            config.update(args.config)
+            config["job_execution_id"] = q_business.start_data_source_sync_job(
+                applicationId=config["application_Id"],
+                indexId=config["index_id"],
+                dataSourceId=config["data_source_id"])['executionId']
+            connector = BenchmarkConnector(config, q_business)
+            start = time.monotonic()
+            try:
+                connector.get_docs()
+            finally:
+                connector.close()
+                q_business.stop_data_source_sync_job(
+                    applicationId=config["application_Id"],
+                    indexId=config["index_id"],
+                    dataSourceId=config["data_source_id"])
+            elapsed = time.monotonic() - start
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    received = q_business.documents
+    latencies = sorted((received[x]['receivedAt'] - connector.started[x]) * 1000
+        for x in received if x in connector.started)
+    uploadedBytes = sum(x['bytes'] or 0 for x in received.values())
+    commit, dirty = gitRevision()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "parameters": {
+            "documents": args.documents,
+            "sizes": args.sizes,
+            "seed": args.seed,
+            "latency_ms": args.latency_ms,
+            "error_rate": args.error_rate,
+            "throttle_rate": args.throttle_rate,
+            "failure_rate": args.failure_rate,
+            "upload_latency_ms": args.upload_latency_ms,
+            "server": args.server,
+            "config": args.config,
+        },
+        "corpus_bytes": corpusBytes,
+        "documents_uploaded": len(received),
+        "elapsed_seconds": round(elapsed, 3),
+        "documents_per_second": round(len(received) / elapsed, 2),
+        "bytes_per_second": round(uploadedBytes / elapsed),
+        "latency_p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "latency_p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+        "qbusiness": q_business.summary(),
+        "metrics": connector.metrics.snapshot(),
+    }
+
+def parseConfig(value):
+    key, _, setting = value.partition("=")
+    if not key or not _:
+        raise argparse.ArgumentTypeError(f"Expected key=value, got {value}.")
+    return key, setting
+
+def main():
+    parser = argparse.ArgumentParser(description="End to end throughput benchmark of the generic connector.")
+    parser.add_argument("--documents", type=int, default=500, help="number of documents in the corpus")
+    parser.add_argument("--sizes", default="lognormal:100000:1.0",
+        help="document size distribution: fixed:<bytes>, uniform:<min>:<max> or lognormal:<median>:<sigma>")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the corpus generator")
+    parser.add_argument("--latency-ms", type=float, default=0, help="latency added to every document API request")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of document API requests answered with HTTP 503")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="fraction of Q Business calls failing with ThrottlingException")
+    parser.add_argument("--failure-rate", type=float, default=0, help="fraction of documents Q Business reports in failedDocuments")
+    parser.add_argument("--upload-latency-ms", type=float, default=0, help="latency of every Q Business call")
+    parser.add_argument("--server", choices=["flask", "gunicorn"], default="flask", help="how server.py is served")
+    parser.add_argument("--config", type=parseConfig, action="append", default=[],
+        help="connector setting as key=value, e.g. fetch_workers=16; may be repeated")
+    parser.add_argument("--output", help="append the result as a JSON line to this file")
+    args = parser.parse_args()
+    args.config = dict(args.config)
+
+    logging.basicConfig(level="WARNING")
+    result = runBenchmark(args)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+if __name__ == '__main__':
+    main()
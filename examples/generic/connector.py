@@ -1,57 +1,109 @@
-import boto3
-import os
-import logging
-import sys
-from dotenv import load_dotenv
-from generic import generic
-
-load_dotenv()
-
-logging.basicConfig(level="INFO")
-
-if __name__=="__main__": 
-    config = {}
-    # Q Business Configurations
-    config["index_id"] = os.getenv('Q_INDEX_ID')
-    config["data_source_id"] = os.getenv('Q_DATASOURCE_ID')
-    config["application_Id"] = os.getenv('Q_APPLICATION_ID')
-
-    # Generic oAuth2 Configurations
-    config["client_id"] = os.getenv('OAUTH2_CLIENT_ID')
-    config["secret"] = os.getenv('OAUTH2_SECRET')
-    config['token_url'] = os.getenv('OAUTH2_TOKEN_URL')
-
-    q_business = boto3.client('qbusiness')
-
-    #Start a data source sync job
-    result = q_business.start_data_source_sync_job(
-            applicationId=config["application_Id"],
-            dataSourceId=config["data_source_id"],
-            indexId=config["index_id"]
-    )
-
-    logging.info("Start data source sync operation.")
-
-    #Obtain the job execution ID from the result
-    job_execution_id = result['executionId']
-    logging.info("Job execution ID: "+job_execution_id)
-    config['job_execution_id'] = job_execution_id
-
-    genericClient = generic(config, q_business)
-
-    #Start ingesting documents
-    try:
-        #Part of the workflow will require you to have a list with your documents ready
-        #for ingestion
-        genericClient.get_docs()
-
-    #Stop data source sync job
-    finally:
-        # Stop data source sync
-        result = q_business.stop_data_source_sync_job(
-            applicationId=config["application_Id"],
-            dataSourceId=config["data_source_id"],
-            indexId=config["index_id"]        
-        )
-        logging.info("Stop data source sync operation.")
+import boto3
+import os
+import asyncio
+import logging
+import sys
+from dotenv import load_dotenv
+from generic import generic
+
+load_dotenv()
+
+logging.basicConfig(level="INFO")
+
+if __name__=="__main__": 
+    config = {}
+    # Q Business Configurations
+    config["index_id"] = os.getenv('Q_INDEX_ID')
+    config["data_source_id"] = os.getenv('Q_DATASOURCE_ID')
+    config["application_Id"] = os.getenv('Q_APPLICATION_ID')
+
+    # Generic oAuth2 Configurations
+    config["client_id"] = os.getenv('OAUTH2_CLIENT_ID')
+    config["secret"] = os.getenv('OAUTH2_SECRET')
+    config['token_url'] = os.getenv('OAUTH2_TOKEN_URL')
+
+    # Mock API Server URL, defaults to http://127.0.0.1:5000
+    config['datasource_url'] = os.getenv('GENERIC_DATASOURCE_URL')
+
+    # Connector tuning
+    config["fetch_workers"] = os.getenv('FETCH_WORKERS')
+    config["rate_limit"] = os.getenv('RATE_LIMIT')
+    config["rate_burst"] = os.getenv('RATE_BURST')
+    config["upload_workers"] = os.getenv('UPLOAD_WORKERS')
+    config["max_document_bytes"] = os.getenv('MAX_DOCUMENT_BYTES')
+    config["spool_bytes"] = os.getenv('SPOOL_BYTES')
+    config["metrics_sinks"] = os.getenv('METRICS_SINKS')
+    config["progress_seconds"] = os.getenv('PROGRESS_SECONDS')
+    config["bulk_fetch_size"] = os.getenv('BULK_FETCH_SIZE')
+
+    # Transformers applied after the connector's own, e.g. pdf_text,split
+    config["transformers"] = os.getenv('TRANSFORMERS')
+    config["transform_workers"] = os.getenv('TRANSFORM_WORKERS')
+    config["transform_inline"] = os.getenv('TRANSFORM_INLINE')
+
+    # Run the asyncio port of the connector, which needs aiohttp
+    useAsync = (os.getenv('ASYNC') or '').lower() in ('1', 'true', 'yes')
+    config["max_in_flight"] = os.getenv('MAX_IN_FLIGHT')
+
+    # Source retries, circuit breaker and dead letters
+    config["source_retries"] = os.getenv('SOURCE_RETRIES')
+    config["retry_budget"] = os.getenv('RETRY_BUDGET')
+    config["breaker_threshold"] = os.getenv('BREAKER_THRESHOLD')
+    config["breaker_reset_seconds"] = os.getenv('BREAKER_RESET_SECONDS')
+    config["dead_letter_path"] = os.getenv('DEAD_LETTER_PATH')
+    config["replay_dead_letters"] = os.getenv('REPLAY_DEAD_LETTERS')
+
+    # Incremental sync checkpoint
+    config["checkpoint_path"] = os.getenv('CHECKPOINT_PATH', f"checkpoint-{config['data_source_id']}.db")
+    config["full_sync"] = os.getenv('FULL_SYNC')
+
+    # Large documents are staged in S3 instead of being sent inline
+    config["s3_bucket"] = os.getenv('S3_BUCKET')
+    config["s3_prefix"] = os.getenv('S3_PREFIX')
+    config["s3_threshold"] = os.getenv('S3_THRESHOLD')
+    config["s3_role_arn"] = os.getenv('S3_ROLE_ARN')
+
+    q_business = boto3.client('qbusiness')
+
+    #Start a data source sync job
+    result = q_business.start_data_source_sync_job(
+            applicationId=config["application_Id"],
+            dataSourceId=config["data_source_id"],
+            indexId=config["index_id"]
+    )
+
+    logging.info("Start data source sync operation.")
+
+    #Obtain the job execution ID from the result
+    job_execution_id = result['executionId']
+    logging.info("Job execution ID: "+job_execution_id)
+    config['job_execution_id'] = job_execution_id
+
+    if useAsync:
+        from generic_async import generic_async
+        genericClient = generic_async(config, q_business)
+    else:
+        genericClient = generic(config, q_business)
+
+    #Start ingesting documents
+    try:
+        #Part of the workflow will require you to have a list with your documents ready
+        #for ingestion
+        if useAsync:
+            asyncio.run(genericClient.run())
+        else:
+            genericClient.get_docs()
+
+    #Stop data source sync job
+    finally:
+        # Run summary: logged, and written as CloudWatch EMF when in Lambda
+        genericClient.metrics.emit()
+        genericClient.close()
+        # Stop data source sync
+        result = q_business.stop_data_source_sync_job(
+            applicationId=config["application_Id"],
+            dataSourceId=config["data_source_id"],
+            indexId=config["index_id"]        
+        )
+        logging.info("Stop data source sync operation.")
         logging.debug(result)
\ No newline at end of file
@@ -1,53 +1,85 @@
-import sys
-import logging
-import json
-import time
-sys.path.append("../../")
-from common import generic_connector
-
-class generic(generic_connector):
-    def get_docs(self):
-        documentBatch = []
-        tokenResult = self.getAccessToken()
-        try:
-            logging.info("Getting documents from mock API Server.")
-            mockAPIServerURL = "http://127.0.0.1:5000/getListDocs"
-            content = self.callSourceAPI(tokenResult["access_token"], mockAPIServerURL, {})
-            documentsResult = json.loads(content)
-            documents = documentsResult['documents']
-            logging.info(f"Found {len(documents)} documents.")
-        except Exception as e:
-            logging.error("Error getting documents from mock API Server.")
-            logging.error(e)
-            return
-
-        for x in documents:
-            getPDFFileLink = f"http://127.0.0.1:5000/getDoc?name={x['name']}"
-            content = self.callSourceAPI(tokenResult["access_token"], getPDFFileLink, {})
-            filename = x['name']
-            logging.info(f"Adding {filename} to upload batch.")
-            doc = {
-                "id": filename,
-                "contentType":"PDF",
-                "title": filename,
-                "content": {
-                    "blob": content
-                },
-                "attributes": [ 
-                    { 
-                        "name": "_category",
-                        "value": {
-                            "stringValue":"Documents"
-                        }
-                    }
-                ],
-            }
-            if len(documentBatch) >= 10:
-                self.uploadDocuments(documentBatch)
-                documentBatch = []
-            documentBatch.append(doc)
-            time.sleep(1)
-
-        if len(documentBatch) > 0:
-            self.uploadDocuments(documentBatch)
-            documentBatch = []
\ No newline at end of file
+import sys
+import logging
+import json
+from urllib.parse import urlencode
+sys.path.append("../../")
+from common import generic_connector, Document
+
+# Documents requested per page of the mock API Server listing
+LIST_PAGE_SIZE = 1000
+# Where the mock API Server runs unless datasource_url is set
+DEFAULT_DATASOURCE_URL = "http://127.0.0.1:5000"
+
+class generic(generic_connector):
+    transformers = [
+        ("attributes", {
+            "static": {"_category": "Documents"},
+            "fields": {"_last_updated_at": ("lastModified", "date")},
+        }),
+    ]
+
+    def get_docs(self):
+        accessToken = self.tokenProvider.getToken()
+        datasourceURL = self.config.get('datasource_url') or DEFAULT_DATASOURCE_URL
+        # A replay fetches the dead-lettered documents instead of the listing
+        if self.replay:
+            documents = self.deadLetterKeys()
+        else:
+            try:
+                logging.info("Getting documents from mock API Server.")
+                mockAPIServerURL = f"{datasourceURL}/getListDocs"
+                documents = []
+                query = {"limit": LIST_PAGE_SIZE}
+                while True:
+                    with self.metrics.timer("list.page"):
+                        content = self.callSourceAPI(accessToken, f"{mockAPIServerURL}?{urlencode(query)}", {})
+                        documentsResult = json.loads(content)
+                    self.metrics.increment("list.documents", len(documentsResult['documents']))
+                    documents.extend(documentsResult['documents'])
+                    if not documentsResult.get('nextCursor'):
+                        break
+                    query['cursor'] = documentsResult['nextCursor']
+                logging.info(f"Found {len(documents)} documents.")
+            except Exception as e:
+                logging.error("Error getting documents from mock API Server.")
+                logging.error(e)
+                return
+
+        listedIds = {x['name'] for x in documents}
+        documents = [x for x in documents if self.documentChanged(x['name'], x.get('lastModified'))]
+        logging.info(f"{len(documents)} documents are new or changed since the last sync.")
+
+        # With bulk_fetch_size set, documents are downloaded several at a time
+        # through /getDocs instead of one request each.
+        if self.bulkFetchSize:
+            fetchItems = ((x, x['name']) for x in documents)
+            results = self.fetchDocumentsBulk(fetchItems, f"{datasourceURL}/getDocs", getId=lambda x: x['name'])
+        else:
+            fetchItems = ((x, f"{datasourceURL}/getDoc?name={x['name']}") for x in documents)
+            results = self.fetchDocuments(fetchItems, getId=lambda x: x['name'])
+
+        def fetchedDocuments():
+            for result in results:
+                filename = result.key['name']
+                if result.error:
+                    logging.error(f"Error downloading {filename} from mock API Server.")
+                    logging.error(result.error)
+                    continue
+                yield result.key, Document(filename, result.content, title=filename)
+
+        # Attributes and any configured transformers are applied by the
+        # transformer stage, see transformers above.
+        with self.documentUploader() as uploader, self.documentBatcher(uploader.submit) as documentBatch:
+            for result in self.transformDocuments(fetchedDocuments()):
+                if result.error:
+                    logging.error(f"Error transforming {result.key['name']}.")
+                    logging.error(result.error)
+                    continue
+                for doc in result.documents:
+                    logging.debug(f"Adding {doc.id} to upload batch.")
+                    documentBatch.add(doc)
+
+        if self.replay:
+            self.deadLetters.replayed()
+        else:
+            self.deleteMissingDocuments(listedIds)
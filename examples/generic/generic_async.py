@@ -0,0 +1,69 @@
+import sys
+import logging
+import json
+from urllib.parse import urlencode
+sys.path.append("../../")
+from common import Document
+from async_common import async_generic_connector
+from generic import generic, LIST_PAGE_SIZE, DEFAULT_DATASOURCE_URL
+
+class generic_async(async_generic_connector):
+    # The generic connector on asyncio, see async_common.py. Downloads are
+    # limited by max_in_flight and rate_limit instead of fetch_workers.
+    transformers = generic.transformers
+
+    async def get_docs(self):
+        datasourceURL = self.config.get('datasource_url') or DEFAULT_DATASOURCE_URL
+        # A replay fetches the dead-lettered documents instead of the listing
+        if self.replay:
+            documents = self.deadLetterKeys()
+        else:
+            try:
+                logging.info("Getting documents from mock API Server.")
+                mockAPIServerURL = f"{datasourceURL}/getListDocs"
+                documents = []
+                query = {"limit": LIST_PAGE_SIZE}
+                while True:
+                    with self.metrics.timer("list.page"):
+                        content = await self.callSourceAPI(await self.tokenProvider.getToken(), f"{mockAPIServerURL}?{urlencode(query)}", {})
+                        documentsResult = json.loads(content)
+                    self.metrics.increment("list.documents", len(documentsResult['documents']))
+                    documents.extend(documentsResult['documents'])
+                    if not documentsResult.get('nextCursor'):
+                        break
+                    query['cursor'] = documentsResult['nextCursor']
+                logging.info(f"Found {len(documents)} documents.")
+            except Exception as e:
+                logging.error("Error getting documents from mock API Server.")
+                logging.error(e)
+                return
+
+        listedIds = {x['name'] for x in documents}
+        documents = [x for x in documents if self.documentChanged(x['name'], x.get('lastModified'))]
+        logging.info(f"{len(documents)} documents are new or changed since the last sync.")
+
+        fetchItems = ((x, f"{datasourceURL}/getDoc?name={x['name']}") for x in documents)
+
+        async def fetchedDocuments():
+            async for result in self.fetchDocuments(fetchItems, getId=lambda x: x['name']):
+                filename = result.key['name']
+                if result.error:
+                    logging.error(f"Error downloading {filename} from mock API Server.")
+                    logging.error(result.error)
+                    continue
+                yield result.key, Document(filename, result.content, title=filename)
+
+        with self.documentUploader() as uploader, self.documentBatcher(uploader.submit) as documentBatch:
+            async for result in self.transformDocuments(fetchedDocuments()):
+                if result.error:
+                    logging.error(f"Error transforming {result.key['name']}.")
+                    logging.error(result.error)
+                    continue
+                for doc in result.documents:
+                    logging.debug(f"Adding {doc.id} to upload batch.")
+                    await self.addDocument(documentBatch, doc)
+
+        if self.replay:
+            self.deadLetters.replayed()
+        else:
+            self.deleteMissingDocuments(listedIds)
@@ -0,0 +1,16 @@
+# Production server for the mock data source:
+#   gunicorn --config gunicorn.conf.py server:app
+# WEB_WORKERS and WEB_THREADS size the server; each worker is a separate
+# process with its own thread pool and directory index.
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_WORKERS') or multiprocessing.cpu_count() * 2 + 1)
+worker_class = "gthread"
+threads = int(os.getenv('WEB_THREADS') or 4)
+# Documents are sent with sendfile(2) straight from the page cache
+sendfile = True
+timeout = int(os.getenv('WEB_TIMEOUT') or 120)
+keepalive = 5
+accesslog = "-"
@@ -1,106 +1,272 @@
-import time
-import json
-import os
-from flask import Flask, request, send_file
-
-ISSUER = 'mock-auth-server'
-LIFE_SPAN = 1800
-
-app = Flask(__name__)
-
-@app.route('/')
-def health():
-    return 'healthy'
-
-@app.route('/getDoc')
-def getDoc():
-    # Checks if the access token is present and valid. 
-    auth_header = request.headers.get('Authorization')
-    if 'Bearer' not in auth_header:
-        return json.dumps({
-            'error': 'Access token does not exist.'
-        }), 400
-  
-    access_token = auth_header[7:]
-
-    if access_token and verify_access_token(access_token):
-        name = request.args.get('name')
-        return return_doc(name)
-    else:
-        return json.dumps({
-            'error': 'Access token is invalid.'
-        }), 400
-
-@app.route('/getListDocs')
-def getListDocs():
-    # Checks if the access token is present and valid. 
-    auth_header = request.headers.get('Authorization')
-    if 'Bearer' not in auth_header:
-        return json.dumps({
-            'error': 'Access token does not exist.'
-        }), 400
-  
-    access_token = auth_header[7:]
-
-    if access_token and verify_access_token(access_token):
-        return return_doc_list()
-    else:
-        return json.dumps({
-            'error': 'Access token is invalid.'
-        }), 400
-
-@app.route('/oauth/token', methods = ['POST'])
-def getToken():
-    client_id = request.form.get('client_id')
-    client_secret = request.form.get('client_secret')
-    if None in [client_id, client_secret]:
-        return json.dumps({
-            "error": "invalid_request"
-        }), 400
-    if not authenticate_client(client_id, client_secret):
-        return json.dumps({
-            "error": "invalid_client"
-        }), 400
-    access_token = generate_access_token()
-    return json.dumps({ 
-        "access_token": access_token,
-        "token_type": "JWT",
-        "expires_in": LIFE_SPAN
-    })
-
-def return_doc(name):
-    try:
-        return send_file("documents/"+name)
-    except Exception as e:
-        return json.dumps({"error":str(e)})
-
-def return_doc_list():
-    files = os.listdir('documents')
-    documents = []
-    for x in files:
-        documents.append({
-            "name": x
-        })
-    return json.dumps({
-        "documents": documents
-    })
-
-def generate_access_token():
-    payload = {
-        "iss": ISSUER,
-        "exp": time.time() + LIFE_SPAN,
-    }
-
-    access_token = "accesstoken"
-    return access_token
-
-def authenticate_client(client_id, client_secret):
-    return True
-
-def verify_access_token(access_token):
-    if access_token == "accesstoken":
-        return True
-    return False
-
-if __name__ == '__main__':
-   app.run(host='0.0.0.0')
\ No newline at end of file
+import time
+import json
+import os
+import base64
+import bisect
+import struct
+import random
+import threading
+from flask import Flask, Response, request, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+ISSUER = 'mock-auth-server'
+LIFE_SPAN = 1800
+# Folder of the served documents, relative to the working directory
+DOCUMENTS_DIR = os.path.abspath(os.getenv('DOCUMENTS_DIR', 'documents'))
+# Seconds a directory listing is served from cache before files are checked
+# for changes again. Added or removed files are picked up straight away.
+INDEX_TTL = float(os.getenv('INDEX_TTL', '5'))
+# Documents serialized per chunk of a streamed listing
+LIST_CHUNK_SIZE = 1000
+# Bytes read from a document file per chunk of a /getDocs response
+CONTENT_CHUNK_SIZE = 64 * 1024
+# Most documents returned by one /getDocs request
+BULK_MAX_DOCUMENTS = 100
+# Artificial latency and failure rate of the document APIs, for load tests
+MOCK_LATENCY_MS = float(os.getenv('MOCK_LATENCY_MS', '0'))
+MOCK_ERROR_RATE = float(os.getenv('MOCK_ERROR_RATE', '0'))
+
+app = Flask(__name__)
+
+@app.route('/')
+def health():
+    return 'healthy'
+
+@app.before_request
+def inject_latency_and_errors():
+    if request.path in ('/', '/oauth/token'):
+        return None
+    if MOCK_LATENCY_MS:
+        time.sleep(MOCK_LATENCY_MS / 1000)
+    if MOCK_ERROR_RATE and random.random() < MOCK_ERROR_RATE:
+        return json.dumps({
+            'error': 'Injected failure.'
+        }), 503, {'Retry-After': '0'}
+
+@app.route('/getDoc')
+def getDoc():
+    # Checks if the access token is present and valid. 
+    auth_header = request.headers.get('Authorization')
+    if 'Bearer' not in auth_header:
+        return json.dumps({
+            'error': 'Access token does not exist.'
+        }), 400
+  
+    access_token = auth_header[7:]
+
+    if access_token and verify_access_token(access_token):
+        name = request.args.get('name')
+        return return_doc(name)
+    else:
+        return json.dumps({
+            'error': 'Access token is invalid.'
+        }), 400
+
+@app.route('/getDocs')
+def getDocs():
+    # Checks if the access token is present and valid. 
+    auth_header = request.headers.get('Authorization')
+    if 'Bearer' not in auth_header:
+        return json.dumps({
+            'error': 'Access token does not exist.'
+        }), 400
+  
+    access_token = auth_header[7:]
+
+    if access_token and verify_access_token(access_token):
+        names = request.args.getlist('name')
+        if not names or len(names) > BULK_MAX_DOCUMENTS:
+            return json.dumps({
+                'error': f'Between 1 and {BULK_MAX_DOCUMENTS} names are required.'
+            }), 400
+        return return_docs(names)
+    else:
+        return json.dumps({
+            'error': 'Access token is invalid.'
+        }), 400
+
+@app.route('/getListDocs')
+def getListDocs():
+    # Checks if the access token is present and valid. 
+    auth_header = request.headers.get('Authorization')
+    if 'Bearer' not in auth_header:
+        return json.dumps({
+            'error': 'Access token does not exist.'
+        }), 400
+  
+    access_token = auth_header[7:]
+
+    if access_token and verify_access_token(access_token):
+        try:
+            limit = request.args.get('limit', type=int)
+            cursor = request.args.get('cursor')
+            modifiedSince = request.args.get('modifiedSince', type=float)
+            if limit is not None and limit < 1:
+                raise ValueError("limit must be positive.")
+            # Paging and slicing work on one snapshot, so a reload between
+            # them cannot shift the page
+            listing = documentIndex.load()
+            start = documentIndex.position(listing, cursor, modifiedSince)
+        except ValueError as e:
+            return json.dumps({
+                'error': str(e)
+            }), 400
+        return return_doc_list(listing, start, limit)
+    else:
+        return json.dumps({
+            'error': 'Access token is invalid.'
+        }), 400
+
+@app.route('/oauth/token', methods = ['POST'])
+def getToken():
+    client_id = request.form.get('client_id')
+    client_secret = request.form.get('client_secret')
+    if None in [client_id, client_secret]:
+        return json.dumps({
+            "error": "invalid_request"
+        }), 400
+    if not authenticate_client(client_id, client_secret):
+        return json.dumps({
+            "error": "invalid_client"
+        }), 400
+    access_token = generate_access_token()
+    return json.dumps({ 
+        "access_token": access_token,
+        "token_type": "JWT",
+        "expires_in": LIFE_SPAN
+    })
+
+class DocumentIndex:
+    # Cached listing of the documents folder sorted by modification time and
+    # name. Paging in that order means a document modified while a client
+    # pages through the listing shows up again on a later page instead of
+    # being skipped.
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.dirMtime = None
+        self.loadedAt = 0
+        self.documents = []
+        self.keys = []
+        self.mtimes = []
+
+    def load(self):
+        dirMtime = os.stat(self.path).st_mtime_ns
+        with self.lock:
+            if dirMtime != self.dirMtime or time.monotonic() - self.loadedAt > self.ttl:
+                documents = []
+                with os.scandir(self.path) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            documents.append({
+                                "name": entry.name,
+                                "lastModified": entry.stat().st_mtime
+                            })
+                documents.sort(key=lambda x: (x['lastModified'], x['name']))
+                self.documents = documents
+                self.keys = [(x['lastModified'], x['name']) for x in documents]
+                self.mtimes = [x['lastModified'] for x in documents]
+                self.dirMtime = dirMtime
+                self.loadedAt = time.monotonic()
+            # A reload replaces the lists rather than changing them, so the
+            # snapshot stays consistent after the lock is released
+            return self.documents, self.keys, self.mtimes
+
+    def position(self, listing, cursor, modifiedSince):
+        # Index in a load() snapshot of the first document after the cursor
+        # and modified after modifiedSince
+        documents, keys, mtimes = listing
+        start = 0
+        if cursor:
+            start = bisect.bisect_right(keys, decode_cursor(cursor))
+        if modifiedSince is not None:
+            start = max(start, bisect.bisect_right(mtimes, modifiedSince))
+        return start
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        lastModified, name = json.loads(base64.urlsafe_b64decode(cursor))
+        return (float(lastModified), str(name))
+    except Exception:
+        raise ValueError("cursor is invalid.")
+
+documentIndex = DocumentIndex(DOCUMENTS_DIR, INDEX_TTL)
+
+def return_doc(name):
+    # send_from_directory refuses names outside the documents folder and
+    # answers conditional (ETag, Last-Modified) and Range requests.
+    try:
+        return send_from_directory(DOCUMENTS_DIR, name, conditional=True, etag=True)
+    except NotFound:
+        return json.dumps({"error": "Document not found."}), 404
+    except Exception as e:
+        return json.dumps({"error":str(e)})
+
+def return_docs(names):
+    # Streams the documents as length-prefixed frames: a 4 byte name length,
+    # the UTF-8 name, a status byte (0 found, 1 not found) and an 8 byte
+    # content length, all big-endian, followed by the document content or an
+    # error message. Files are read in chunks as they are sent, so a request
+    # for large documents never holds one of them in memory whole.
+    def generate():
+        for name in names:
+            encodedName = name.encode()
+            try:
+                path = safe_join(DOCUMENTS_DIR, name)
+                if path is None:
+                    raise FileNotFoundError(name)
+                f = open(path, 'rb')
+            except OSError:
+                content = b"Document not found."
+                yield struct.pack(">I", len(encodedName)) + encodedName + struct.pack(">BQ", 1, len(content))
+                yield content
+                continue
+            with f:
+                # The header promises this many bytes, so a file that grows
+                # while it is sent is cut at its size here
+                remaining = os.fstat(f.fileno()).st_size
+                yield struct.pack(">I", len(encodedName)) + encodedName + struct.pack(">BQ", 0, remaining)
+                for chunk in iter(lambda: f.read(min(CONTENT_CHUNK_SIZE, remaining)), b""):
+                    remaining -= len(chunk)
+                    yield chunk
+    return Response(generate(), mimetype='application/octet-stream')
+
+def return_doc_list(listing, start, limit):
+    documents, keys, mtimes = listing
+    end = len(documents) if limit is None else min(start + limit, len(documents))
+    nextCursor = encode_cursor(keys[end - 1]) if end < len(documents) else None
+
+    # Large listings are streamed in chunks instead of being serialized into
+    # a single string
+    def generate():
+        yield '{"documents": ['
+        for i in range(start, end, LIST_CHUNK_SIZE):
+            chunk = ", ".join(json.dumps(x) for x in documents[i:min(i + LIST_CHUNK_SIZE, end)])
+            yield (", " if i > start else "") + chunk
+        yield '], "nextCursor": ' + json.dumps(nextCursor) + '}'
+    return Response(generate(), mimetype='application/json')
+
+def generate_access_token():
+    payload = {
+        "iss": ISSUER,
+        "exp": time.time() + LIFE_SPAN,
+    }
+
+    access_token = "accesstoken"
+    return access_token
+
+def authenticate_client(client_id, client_secret):
+    return True
+
+def verify_access_token(access_token):
+    if access_token == "accesstoken":
+        return True
+    return False
+
+if __name__ == '__main__':
+   app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5000')))
\ No newline at end of file
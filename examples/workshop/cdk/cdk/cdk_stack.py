@@ -1,6 +1,10 @@
 import os
+import shutil
+import jsii
 from aws_cdk import (
+    BundlingOptions,
     Duration,
+    ILocalBundling,
     Stack,
     CfnOutput as StackOutput,
     aws_ec2 as ec2,
@@ -9,11 +13,25 @@ from aws_cdk import (
     aws_ecs_patterns as ecs_patterns,
     aws_lambda as lambda_,
     aws_iam as iam,
+    aws_stepfunctions as sfn,
+    aws_stepfunctions_tasks as tasks,
 )
 from aws_cdk.aws_ecr_assets import DockerImageAsset, Platform
 from constructs import Construct
 import cdk_nag as nag
 
+@jsii.implements(ILocalBundling)
+class ReferenceConnectorBundling:
+    # Packages the connector folder with connector.py.complete as its
+    # connector.py, without needing Docker
+    def __init__(self, path):
+        self.path = path
+
+    def try_bundle(self, output_dir, options):
+        shutil.copytree(self.path, output_dir, dirs_exist_ok=True)
+        shutil.copyfile(os.path.join(self.path, "connector.py.complete"), os.path.join(output_dir, "connector.py"))
+        return True
+
 class CdkStack(Stack):
 
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
@@ -51,7 +69,13 @@ class CdkStack(Stack):
                 image=ecs.ContainerImage.from_docker_image_asset(container_image),
                 container_name="qbus-workshop-datasource",
                 container_port=5000,
+                environment={
+                    "WEB_WORKERS": "4",
+                    "WEB_THREADS": "8"
+                }
             ),
+            cpu=1024,
+            memory_limit_mib=2048,
             public_load_balancer=True
         )
 
@@ -95,28 +119,138 @@ class CdkStack(Stack):
             }
         )
 
-        connector_fn.add_to_role_policy(iam.PolicyStatement(
-            actions=[
-                "qbusiness:StartDataSourceSyncJob",
-                "qbusiness:BatchPutDocument",
-                "qbusiness:StopDataSourceSyncJob",
-            ],
-            effect=iam.Effect.ALLOW,
-            resources=[
-                f"*",
-            ]
+        # Reference connector: the completed workshop handler, which the
+        # workshop's own connector.py is a skeleton of. Self-invoking
+        # continuations and the sharded sync state machine need its start,
+        # worker and stop actions.
+        reference_connector_fn = lambda_.Function(self, "ReferenceConnector",
+            code=lambda_.Code.from_asset("../connector",
+                bundling=BundlingOptions(
+                    image=lambda_.Runtime.PYTHON_3_12.bundling_image,
+                    command=["bash", "-c", "cp -r /asset-input/. /asset-output/ && cp /asset-input/connector.py.complete /asset-output/connector.py"],
+                    local=ReferenceConnectorBundling(os.path.abspath("../connector"))
+                )
+            ),
+            handler="connector.lambda_handler",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            memory_size=1024,
+            layers=[dependencies],
+            timeout=Duration.seconds(900),
+            environment={
+                "Q_INDEX_ID": "",
+                "Q_DATASOURCE_ID": "",
+                "Q_APPLICATION_ID": "",
+                "OAUTH2_CLIENT_ID": "clientid",
+                "OAUTH2_SECRET": "secret",
+                "OAUTH2_TOKEN_URL": f'http://{fargate_service.load_balancer.load_balancer_dns_name}/oauth/token',
+                "GENERIC_DATASOURCE_URL": f'http://{fargate_service.load_balancer.load_balancer_dns_name}',
+                "TIME_RESERVE_SECONDS": "60",
+                "SHARD_COUNT": "4"
+            }
+        )
+
+        for fn in (connector_fn, reference_connector_fn):
+            fn.add_to_role_policy(iam.PolicyStatement(
+                actions=[
+                    "qbusiness:StartDataSourceSyncJob",
+                    "qbusiness:BatchPutDocument",
+                    "qbusiness:StopDataSourceSyncJob",
+                ],
+                effect=iam.Effect.ALLOW,
+                resources=[
+                    f"*",
+                ]
+            ))
+            nag.NagSuppressions.add_resource_suppressions(
+                fn,
+                [{
+                    "id": "AwsSolutions-IAM4",
+                    "reason": "This is an Lambda IAM role/policy for the workshop and is meant to be destroyed after the workshop is complete."
+                },{
+                    "id": "AwsSolutions-IAM5",
+                    "reason": "This is an Lambda IAM role/policy for the workshop and is meant to be destroyed after the workshop is complete."
+                },{
+                    "id": "AwsSolutions-L1",
+                    "reason": "This is an Lambda IAM role/policy for the workshop and is meant to be destroyed after the workshop is complete."
+                }],
+                True
+            )
+        # The reference connector re-invokes itself to continue a sync that
+        # would run past the Lambda timeout. The grant is a policy of its
+        # own, as the function already depends on its role's default policy.
+        iam.Policy(self, "ReferenceConnectorSelfInvoke",
+            roles=[reference_connector_fn.role],
+            statements=[iam.PolicyStatement(
+                actions=[
+                    "lambda:InvokeFunction",
+                ],
+                effect=iam.Effect.ALLOW,
+                resources=[
+                    reference_connector_fn.function_arn,
+                ]
+            )]
+        )
+
+        # Sharded sync: a coordinator starts the sync job and splits the
+        # listing, a Map state runs one worker per shard, and the job is
+        # stopped once every shard has finished or any of them has failed.
+        start_sync = tasks.LambdaInvoke(self, "StartShardedSync",
+            lambda_function=reference_connector_fn,
+            payload=sfn.TaskInput.from_object({"action": "start"}),
+            payload_response_only=True
+        )
+        ingest_shard = tasks.LambdaInvoke(self, "IngestShard",
+            lambda_function=reference_connector_fn,
+            payload=sfn.TaskInput.from_json_path_at("$"),
+            payload_response_only=True
+        )
+        ingest_shards = sfn.Map(self, "IngestShards",
+            items_path="$.shards",
+            max_concurrency=4,
+            result_path=sfn.JsonPath.DISCARD
+        )
+        # A worker that runs out of time returns the position it got to, and
+        # the shard is run again from there until it comes back without one
+        ingest_shards.item_processor(ingest_shard.next(
+            sfn.Choice(self, "ShardIngested")
+                .when(sfn.Condition.is_not_null("$.position"), ingest_shard)
+                .otherwise(sfn.Succeed(self, "ShardDone"))
         ))
+
+        stop_payload = sfn.TaskInput.from_object({
+            "action": "stop",
+            "job_execution_id": sfn.JsonPath.string_at("$.job_execution_id")
+        })
+        stop_sync = tasks.LambdaInvoke(self, "StopShardedSync",
+            lambda_function=reference_connector_fn,
+            payload=stop_payload,
+            payload_response_only=True
+        )
+        stop_failed_sync = tasks.LambdaInvoke(self, "StopFailedShardedSync",
+            lambda_function=reference_connector_fn,
+            payload=stop_payload,
+            payload_response_only=True
+        ).next(sfn.Fail(self, "ShardedSyncFailed"))
+        ingest_shards.add_catch(stop_failed_sync, result_path="$.error")
+
+        sharded_sync = sfn.StateMachine(self, "ShardedSync",
+            definition_body=sfn.DefinitionBody.from_chainable(
+                start_sync.next(ingest_shards).next(stop_sync)
+            ),
+            timeout=Duration.hours(6)
+        )
+
         nag.NagSuppressions.add_resource_suppressions(
-            connector_fn,
+            sharded_sync,
             [{
-                "id": "AwsSolutions-IAM4",
-                "reason": "This is an Lambda IAM role/policy for the workshop and is meant to be destroyed after the workshop is complete."
-            },{
                 "id": "AwsSolutions-IAM5",
-                "reason": "This is an Lambda IAM role/policy for the workshop and is meant to be destroyed after the workshop is complete."
+                "reason": "This is a Step Functions IAM role/policy for the workshop and is meant to be destroyed after the workshop is complete."
+            },{
+                "id": "AwsSolutions-SF1",
+                "reason": "This is a state machine for the workshop and is meant to be destroyed after the workshop is complete."
             },{
-                "id": "AwsSolutions-L1",
-                "reason": "This is an Lambda IAM role/policy for the workshop and is meant to be destroyed after the workshop is complete."
+                "id": "AwsSolutions-SF2",
+                "reason": "This is a state machine for the workshop and is meant to be destroyed after the workshop is complete."
             }],
             True
         )
@@ -124,5 +258,7 @@ class CdkStack(Stack):
         # CFN outputs
         StackOutput(self, "ConnectorArn", value=connector_fn.function_arn)
         StackOutput(self, "ConnectorName", value=connector_fn.function_name)
+        StackOutput(self, "ReferenceConnectorName", value=reference_connector_fn.function_name)
+        StackOutput(self, "ShardedSyncArn", value=sharded_sync.state_machine_arn)
         StackOutput(self, "ImageUri", value=container_image.image_uri)
         StackOutput(self, "StackId", value=self.stack_id)
\ No newline at end of file
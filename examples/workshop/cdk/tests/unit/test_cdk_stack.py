@@ -1,3 +1,4 @@
+import json
 import aws_cdk as core
 import aws_cdk.assertions as assertions
 
@@ -13,3 +14,74 @@ def test_sqs_queue_created():
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+
+def test_sharded_sync_state_machine():
+    app = core.App()
+    stack = CdkStack(app, "cdk")
+    template = assertions.Template.from_stack(stack)
+
+    state_machines = template.find_resources("AWS::StepFunctions::StateMachine")
+    assert len(state_machines) == 1
+    # The definition embeds the function ARN, so it is joined from parts
+    parts = list(state_machines.values())[0]["Properties"]["DefinitionString"]["Fn::Join"][1]
+    definition = json.loads("".join(p if isinstance(p, str) else "ARN" for p in parts))
+
+    assert definition["StartAt"] == "StartShardedSync"
+    assert definition["States"]["StartShardedSync"]["Next"] == "IngestShards"
+    ingest_shards = definition["States"]["IngestShards"]
+    assert ingest_shards["Type"] == "Map"
+    assert ingest_shards["ItemsPath"] == "$.shards"
+    assert ingest_shards["Next"] == "StopShardedSync"
+    assert ingest_shards["Catch"][0]["Next"] == "StopFailedShardedSync"
+    assert definition["States"]["StopFailedShardedSync"]["Next"] == "ShardedSyncFailed"
+
+    # Shards that run out of time are run again from where they stopped
+    shard_states = ingest_shards["ItemProcessor"]["States"]
+    assert shard_states["IngestShard"]["Next"] == "ShardIngested"
+    assert shard_states["ShardIngested"]["Choices"][0] == {
+        "Variable": "$.position", "IsNull": False, "Next": "IngestShard"
+    }
+
+
+def test_datasource_runs_production_server():
+    app = core.App()
+    stack = CdkStack(app, "cdk")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::ECS::TaskDefinition", {
+        "Cpu": "1024",
+        "Memory": "2048",
+        "ContainerDefinitions": [assertions.Match.object_like({
+            "Environment": assertions.Match.array_with([
+                {"Name": "WEB_WORKERS", "Value": "4"}
+            ])
+        })]
+    })
+
+
+def test_reference_connector_runs_sharded_sync_and_only_invokes_itself():
+    app = core.App()
+    stack = CdkStack(app, "cdk")
+    template = assertions.Template.from_stack(stack)
+
+    functions = template.find_resources("AWS::Lambda::Function")
+    reference = [x for x in functions if x.startswith("ReferenceConnector")]
+    assert len(reference) == 1
+    reference = reference[0]
+
+    # The state machine drives the completed handler, not the skeleton
+    state_machine = list(template.find_resources("AWS::StepFunctions::StateMachine").values())[0]
+    parts = state_machine["Properties"]["DefinitionString"]["Fn::Join"][1]
+    arns = [p["Fn::GetAtt"][0] for p in parts if isinstance(p, dict) and "Fn::GetAtt" in p]
+    assert arns and set(arns) == {reference}
+
+    template.has_resource_properties("AWS::IAM::Policy", {
+        "PolicyDocument": {
+            "Statement": [{
+                "Action": "lambda:InvokeFunction",
+                "Effect": "Allow",
+                "Resource": {"Fn::GetAtt": [reference, "Arn"]}
+            }]
+        }
+    })
@@ -0,0 +1,202 @@
+import time
+import uuid
+import random
+import threading
+from botocore.exceptions import ClientError, ParamValidationError
+
+# Limits of the real BatchPutDocument API, from its service model.
+# BatchDeleteDocument sets no document count limit. The request size is
+# estimated the way it goes over the wire: blobs base64 encoded plus the
+# JSON around them.
+MAX_DOCUMENTS_PER_CALL = 10
+MAX_REQUEST_BYTES = 10 * 1024 * 1024
+MAX_DOCUMENT_ID_LENGTH = 1825
+DOCUMENT_METADATA_BYTES = 256
+
+class FakeQBusiness:
+    # In-process stand-in for boto3.client('qbusiness') covering the calls the
+    # connectors make. Requests are validated against the service limits and
+    # rejected the way botocore would: ParamValidationError for arguments of
+    # the wrong type, ClientError for everything the service itself refuses.
+    #
+    # throttleRate is the chance that a call fails with ThrottlingException,
+    # and maxCallsPerSecond throttles calls beyond a steady rate the way the
+    # service quota does. failureRate is the chance that each document comes
+    # back in failedDocuments with one of failureCodes. latency and
+    # secondsPerMB delay every call. All of it is driven by a seeded random
+    # generator so runs can be repeated.
+    #
+    # Every call is recorded in calls and every accepted document in
+    # documents, for tests and benchmarks; summary() aggregates them.
+    def __init__(self, throttleRate=0, failureRate=0, failureCodes=('InternalError',), latency=0,
+            secondsPerMB=0, maxCallsPerSecond=None, seed=None):
+        self.throttleRate = throttleRate
+        self.failureRate = failureRate
+        self.failureCodes = failureCodes
+        self.latency = latency
+        self.secondsPerMB = secondsPerMB
+        self.maxCallsPerSecond = maxCallsPerSecond
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.documents = {}
+        self.deleted = set()
+        self.calls = []
+        self.inFlight = 0
+        self.maxInFlight = 0
+        self.allowance = maxCallsPerSecond or 0
+        self.allowanceAt = time.monotonic()
+
+    def start_data_source_sync_job(self, applicationId, indexId, dataSourceId):
+        with self.lock:
+            key = (applicationId, indexId, dataSourceId)
+            if any(job['key'] == key and job['status'] == 'SYNCING' for job in self.jobs.values()):
+                raise self._error('ConflictException', 'A sync job is already running for this data source.', 409, 'StartDataSourceSyncJob')
+            executionId = str(uuid.uuid4())
+            self.jobs[executionId] = {"key": key, "status": "SYNCING", "startedAt": time.monotonic()}
+        return {"executionId": executionId}
+
+    def stop_data_source_sync_job(self, applicationId, indexId, dataSourceId):
+        with self.lock:
+            key = (applicationId, indexId, dataSourceId)
+            running = [job for job in self.jobs.values() if job['key'] == key and job['status'] == 'SYNCING']
+            if not running:
+                raise self._error('ResourceNotFoundException', 'No sync job is running for this data source.', 404, 'StopDataSourceSyncJob')
+            for job in running:
+                job['status'] = 'STOPPED'
+                job['stoppedAt'] = time.monotonic()
+        return {}
+
+    def batch_put_document(self, applicationId, indexId, documents, roleArn=None, dataSourceSyncId=None):
+        operation = 'BatchPutDocument'
+        self._checkDocuments(documents, operation, MAX_DOCUMENTS_PER_CALL)
+        size = 0
+        for document in documents:
+            if not isinstance(document.get('id'), str) or not 1 <= len(document['id']) <= MAX_DOCUMENT_ID_LENGTH:
+                raise self._error('ValidationException', 'Document ids must be 1 to 1825 characters long.', 400, operation)
+            content = document.get('content') or {}
+            if 'blob' in content:
+                if not isinstance(content['blob'], (bytes, bytearray, str)):
+                    raise ParamValidationError(report=f"Invalid type for parameter documents.content.blob, value: {type(content['blob'])}")
+                size += (len(content['blob']) + 2) // 3 * 4
+            elif 's3' in content:
+                if not roleArn:
+                    raise self._error('ValidationException', 'A roleArn is required for documents stored in S3.', 400, operation)
+            else:
+                raise self._error('ValidationException', 'Documents need a blob or s3 content.', 400, operation)
+            size += DOCUMENT_METADATA_BYTES + len(document['id']) + len(document.get('title') or '')
+        if size > MAX_REQUEST_BYTES:
+            raise self._error('ValidationException', f'The request is {size} bytes, more than the {MAX_REQUEST_BYTES} allowed.', 400, operation)
+
+        def accept(document):
+            content = document['content']
+            self.documents[document['id']] = {
+                "bytes": len(content['blob']) if 'blob' in content else None,
+                "s3": content.get('s3'),
+                "receivedAt": time.monotonic(),
+                "versions": self.documents.get(document['id'], {}).get('versions', 0) + 1,
+            }
+            self.deleted.discard(document['id'])
+
+        return self._call(operation, documents, size, dataSourceSyncId, accept)
+
+    def batch_delete_document(self, applicationId, indexId, documents, dataSourceSyncId=None):
+        operation = 'BatchDeleteDocument'
+        self._checkDocuments(documents, operation)
+        for document in documents:
+            if not isinstance(document.get('documentId'), str):
+                raise ParamValidationError(report="Missing required parameter in documents: documentId")
+
+        def accept(document):
+            self.documents.pop(document['documentId'], None)
+            self.deleted.add(document['documentId'])
+
+        return self._call(operation, documents, 0, dataSourceSyncId, accept)
+
+    def summary(self):
+        # Totals over the recorded calls, with the ingest rate measured from
+        # the first call starting to the last one finishing
+        with self.lock:
+            calls = list(self.calls)
+        puts = [x for x in calls if x['operation'] == 'BatchPutDocument']
+        latencies = sorted(x['finishedAt'] - x['startedAt'] for x in calls)
+        accepted = sum(x['accepted'] for x in puts)
+        elapsed = max(x['finishedAt'] for x in calls) - min(x['startedAt'] for x in calls) if calls else 0
+        return {
+            "calls": len(calls),
+            "throttled": sum(1 for x in calls if x['error'] == 'ThrottlingException'),
+            "rejected": sum(1 for x in calls if x['error'] and x['error'] != 'ThrottlingException'),
+            "documents_accepted": accepted,
+            "documents_failed": sum(x['failed'] for x in puts),
+            "bytes_accepted": sum(x['bytes'] for x in puts if not x['error']),
+            "documents_deleted": len(self.deleted),
+            "documents_per_second": round(accepted / elapsed, 2) if elapsed else None,
+            "max_concurrent_calls": self.maxInFlight,
+            "call_latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        }
+
+    def _checkDocuments(self, documents, operation, maxDocuments=None):
+        if not isinstance(documents, list):
+            raise ParamValidationError(report="Invalid type for parameter documents, value: " + str(type(documents)))
+        if not documents:
+            raise self._error('ValidationException', 'A batch must hold at least 1 document.', 400, operation)
+        if maxDocuments is not None and len(documents) > maxDocuments:
+            raise self._error('ValidationException', f'A batch must hold 1 to {maxDocuments} documents.', 400, operation)
+
+    def _call(self, operation, documents, size, syncId, accept):
+        record = {"operation": operation, "startedAt": time.monotonic(), "documents": len(documents),
+            "bytes": size, "accepted": 0, "failed": 0, "error": None}
+        with self.lock:
+            self.inFlight += 1
+            self.maxInFlight = max(self.maxInFlight, self.inFlight)
+        try:
+            delay = self.latency + self.secondsPerMB * size / (1024 * 1024)
+            if delay:
+                time.sleep(delay)
+            with self.lock:
+                if syncId is not None and self.jobs.get(syncId, {}).get('status') != 'SYNCING':
+                    record['error'] = 'ValidationException'
+                    raise self._error('ValidationException', f'{syncId} is not a running sync job.', 400, operation)
+                if self._throttled():
+                    record['error'] = 'ThrottlingException'
+                    raise self._error('ThrottlingException', 'Rate exceeded.', 429, operation)
+                failedDocuments = []
+                for document in documents:
+                    docId = document.get('id') or document.get('documentId')
+                    if self.failureRate and self.random.random() < self.failureRate:
+                        failedDocuments.append({
+                            "id": docId,
+                            "error": {
+                                "errorCode": self.random.choice(self.failureCodes),
+                                "errorMessage": "Injected failure."
+                            }
+                        })
+                    else:
+                        accept(document)
+                record['accepted'] = len(documents) - len(failedDocuments)
+                record['failed'] = len(failedDocuments)
+            return {"failedDocuments": failedDocuments}
+        finally:
+            record['finishedAt'] = time.monotonic()
+            with self.lock:
+                self.inFlight -= 1
+                self.calls.append(record)
+
+    def _throttled(self):
+        if self.throttleRate and self.random.random() < self.throttleRate:
+            return True
+        if not self.maxCallsPerSecond:
+            return False
+        now = time.monotonic()
+        self.allowance = min(self.maxCallsPerSecond, self.allowance + (now - self.allowanceAt) * self.maxCallsPerSecond)
+        self.allowanceAt = now
+        if self.allowance < 1:
+            return True
+        self.allowance -= 1
+        return False
+
+    def _error(self, code, message, status, operation):
+        return ClientError({
+            "Error": {"Code": code, "Message": message},
+            "ResponseMetadata": {"HTTPStatusCode": status}
+        }, operation)
@@ -0,0 +1,162 @@
+import os
+import re
+import sys
+import json
+import time
+import boto3
+import asyncio
+import inspect
+import logging
+import argparse
+import importlib
+import threading
+from common import SharedResources, DEFAULT_FETCH_WORKERS, DEFAULT_UPLOAD_WORKERS
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Runs several connectors in one process from a YAML or JSON file:
+#
+#   upload_workers: 8          # threads shared by every source's uploads
+#   http_pool_size: 32         # keep-alive connections per host, shared
+#   defaults:                  # connector config applied to every source
+#     application_Id: ${Q_APPLICATION_ID}
+#     index_id: ${Q_INDEX_ID}
+#   sources:
+#     - name: documents
+#       connector: generic.generic     # module.class of a generic_connector or async_generic_connector
+#       path: examples/generic         # added to sys.path, relative to this file
+#       config:
+#         data_source_id: ${GENERIC_DATASOURCE_ID}
+#         fetch_workers: 4             # this source's download quota
+#         upload_workers: 2            # this source's share of the upload queue
+#
+# ${VAR} references are replaced from the environment and must be set. Every
+# source gets its own sync job, checkpoint and metrics, while HTTP
+# connections, cached tokens for the same credentials and upload threads are
+# shared.
+
+ENVIRONMENT_REFERENCE = re.compile(r"\$\{(\w+)\}")
+
+def environmentValue(match):
+    if match.group(1) not in os.environ:
+        raise ValueError(f"Environment variable {match.group(1)} is not set.")
+    return os.environ[match.group(1)]
+
+def loadConfig(path):
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise RuntimeError("PyYAML is required for YAML configs, install it or use a JSON config.")
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+    return expandEnvironment(config)
+
+def expandEnvironment(value):
+    if isinstance(value, str):
+        return ENVIRONMENT_REFERENCE.sub(environmentValue, value)
+    if isinstance(value, list):
+        return [expandEnvironment(x) for x in value]
+    if isinstance(value, dict):
+        return {k: expandEnvironment(v) for k, v in value.items()}
+    return value
+
+def loadConnector(spec, path):
+    if path and path not in sys.path:
+        sys.path.append(path)
+    module, _, name = spec.rpartition(".")
+    return getattr(importlib.import_module(module), name)
+
+def sourceConfig(source, defaults):
+    config = dict(defaults)
+    config.update(source.get('config') or {})
+    for key in ("application_Id", "index_id", "data_source_id"):
+        if not config.get(key):
+            raise ValueError(f"Source {source['name']} has no {key}.")
+    config.setdefault("checkpoint_path", f"checkpoint-{config['data_source_id']}.db")
+    return config
+
+def runSource(source, connector, config, q_business, resources):
+    # One sync job per source, stopped whatever happens to get_docs
+    started = time.monotonic()
+    result = q_business.start_data_source_sync_job(
+            applicationId=config["application_Id"],
+            dataSourceId=config["data_source_id"],
+            indexId=config["index_id"]
+    )
+    config['job_execution_id'] = result['executionId']
+    logging.info(f"Started sync job {result['executionId']} for {source['name']}.")
+    client = None
+    try:
+        client = connector(config, q_business, resources)
+        if inspect.iscoroutinefunction(client.get_docs):
+            # Async connectors get an event loop of their own in this thread
+            asyncio.run(client.run())
+        else:
+            client.get_docs()
+    finally:
+        if client is not None:
+            client.metrics.emit()
+            client.close()
+        q_business.stop_data_source_sync_job(
+            applicationId=config["application_Id"],
+            dataSourceId=config["data_source_id"],
+            indexId=config["index_id"]
+        )
+        logging.info(f"Stopped sync job for {source['name']} after {time.monotonic() - started:.1f} seconds.")
+
+def run(config, baseDir=".", q_business=None):
+    # Runs every source concurrently and returns {name: error or None}
+    q_business = q_business or boto3.client('qbusiness')
+    defaults = config.get('defaults') or {}
+    sources = config.get('sources') or []
+    if not sources:
+        raise ValueError("No sources configured.")
+    names = [x['name'] for x in sources]
+    if len(set(names)) != len(names):
+        raise ValueError("Source names must be unique.")
+    jobs = []
+    for source in sources:
+        path = os.path.join(baseDir, source['path']) if source.get('path') else None
+        jobs.append((source, loadConnector(source['connector'], path), sourceConfig(source, defaults)))
+
+    resources = SharedResources(
+        httpPoolSize=int(config.get('http_pool_size') or DEFAULT_FETCH_WORKERS * len(sources)),
+        uploadWorkers=int(config.get('upload_workers') or DEFAULT_UPLOAD_WORKERS))
+    errors = {}
+
+    def runJob(source, connector, sourceConfig):
+        try:
+            runSource(source, connector, sourceConfig, q_business, resources)
+            errors[source['name']] = None
+        except Exception as e:
+            logging.exception(f"Sync of {source['name']} failed.")
+            errors[source['name']] = e
+
+    threads = [threading.Thread(target=runJob, args=job, name=job[0]['name']) for job in jobs]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        resources.close()
+    return errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several Amazon Q Business connectors in one process.")
+    parser.add_argument("config", help="YAML or JSON file listing the sources")
+    args = parser.parse_args()
+
+    logging.basicConfig(level="INFO", format="%(threadName)s %(levelname)s %(message)s")
+    errors = run(loadConfig(args.config), os.path.dirname(os.path.abspath(args.config)))
+    failed = [name for name, error in errors.items() if error is not None]
+    if failed:
+        logging.error(f"{len(failed)} of {len(errors)} sources failed: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import threading
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import generic_connector
+from fake_qbusiness import FakeQBusiness
+
+class ScriptedSource:
+    # Local HTTP source whose answers tests script per path. Each answer is a
+    # (status, body, headers) tuple; a body of TRUNCATED promises more bytes
+    # than it sends and drops the connection. Paths without answers left get
+    # 200 with a body of the path. /oauth/token always hands out a token.
+    TRUNCATED = object()
+
+    def __init__(self):
+        self.answers = defaultdict(deque)
+        self.requests = []
+        source = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                source.requests.append(self.path)
+                answers = source.answers[self.path]
+                status, body, headers = answers.popleft() if answers else (200, self.path.encode(), {})
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if body is ScriptedSource.TRUNCATED:
+                    self.send_header("Content-Length", "100000")
+                    self.end_headers()
+                    self.wfile.write(b"x" * 1000)
+                    self.close_connection = True
+                    return
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                body = json.dumps({"access_token": "token", "expires_in": 3600}).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def script(self, path, *answers):
+        for answer in answers:
+            self.answers[path].append(answer if isinstance(answer, tuple) else (answer, b"", {}))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def source():
+    source = ScriptedSource()
+    yield source
+    source.close()
+
+@pytest.fixture
+def q_business():
+    return FakeQBusiness()
+
+@pytest.fixture
+def makeConnector(source, q_business, tmp_path):
+    # Builds connectors against source and q_business with a fresh sync job,
+    # quick retries and a checkpoint file in tmp_path, which connectors made
+    # one after the other share like consecutive syncs. Keyword arguments are
+    # added to the config.
+    connectors = []
+
+    def make(cls=generic_connector, **config):
+        if connectors:
+            q_business.stop_data_source_sync_job(applicationId="app", indexId="index", dataSourceId="source")
+        job = q_business.start_data_source_sync_job(applicationId="app", indexId="index", dataSourceId="source")
+        connector = cls({
+            "application_Id": "app",
+            "index_id": "index",
+            "data_source_id": "source",
+            "job_execution_id": job["executionId"],
+            "client_id": "client",
+            "secret": "secret",
+            "token_url": source.url + "/oauth/token",
+            "metrics_sinks": "none",
+            "checkpoint_path": str(tmp_path / "checkpoints.db"),
+            "rate_limit": "1000",
+            "retry_backoff": "0.01",
+            "transform_inline": "true",
+            **config}, q_business)
+        connectors.append(connector)
+        return connector
+
+    yield make
+    for connector in connectors:
+        connector.close()
@@ -0,0 +1,171 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from common import BatchUploader, Document, DocumentBatcher, RateLimiter, Metrics
+from fake_qbusiness import FakeQBusiness
+
+def documents(count, size=10):
+    return [Document(f"doc-{i}", b"x" * size, contentType="PLAIN_TEXT") for i in range(count)]
+
+def putDocuments(q_business):
+    def upload(batch):
+        return q_business.batch_put_document(applicationId="app", indexId="index", documents=[d.toRequest() for d in batch])
+    return upload
+
+def test_rate_limiter_allows_a_burst_then_the_rate():
+    limiter = RateLimiter(10, burst=3)
+    assert [limiter.tryAcquire() for _ in range(3)] == [0, 0, 0]
+    assert 0 < limiter.tryAcquire() <= 0.1
+
+def test_rate_limiter_backs_off_and_recovers():
+    limiter = RateLimiter(10)
+    limiter.backoff(retryAfter=0.2)
+    assert limiter.rate == 5
+    assert limiter.tryAcquire() > 0.15
+    limiter.backoff()
+    limiter.backoff()
+    assert limiter.rate == 1.25
+    for _ in range(20):
+        limiter.recover()
+    assert limiter.rate == 10
+
+def test_rate_limiter_never_stops():
+    limiter = RateLimiter(1)
+    for _ in range(10):
+        limiter.backoff()
+    assert limiter.rate == 0.1
+
+def test_batcher_respects_the_document_count():
+    batches = []
+    with DocumentBatcher(batches.append, maxDocuments=10) as batcher:
+        for document in documents(25):
+            batcher.add(document)
+    assert [len(x) for x in batches] == [10, 10, 5]
+
+def test_batcher_respects_the_request_size():
+    batches = []
+    single = documents(1, 3000)[0].size()
+    with DocumentBatcher(batches.append, maxBytes=single * 3 + 1) as batcher:
+        for document in documents(7, 3000):
+            batcher.add(document)
+    assert [len(x) for x in batches] == [3, 3, 1]
+    assert all(sum(d.size() for d in x) <= single * 3 + 1 for x in batches)
+
+def test_batcher_flushes_old_batches():
+    batches = []
+    batcher = DocumentBatcher(batches.append, maxAge=0.05)
+    batcher.add(documents(1)[0])
+    time.sleep(0.2)
+    assert [len(x) for x in batches] == [1]
+    batcher.close()
+    assert len(batches) == 1
+
+def test_uploader_retries_throttled_calls():
+    q_business = FakeQBusiness(throttleRate=0.5, seed=1)
+    accepted = []
+    metrics = Metrics()
+    with BatchUploader(putDocuments(q_business), retries=8, backoff=0.001, onSuccess=accepted.extend, metrics=metrics) as uploader:
+        for i in range(0, 50, 10):
+            uploader.submit(documents(50)[i:i + 10])
+    assert sorted(d.id for d in accepted) == sorted(d.id for d in documents(50))
+    assert len(q_business.documents) == 50
+    assert metrics.snapshot()['counters']['upload.throttles'] > 0
+    assert not uploader.failedDocuments
+
+def test_uploader_retries_failed_documents_only():
+    q_business = FakeQBusiness(failureRate=0.3, seed=2)
+    with BatchUploader(putDocuments(q_business), retries=10, backoff=0.001) as uploader:
+        uploader.submit(documents(10))
+    assert len(q_business.documents) == 10
+    assert all(x['versions'] == 1 for x in q_business.documents.values())
+
+def test_uploader_reports_documents_that_keep_failing():
+    q_business = FakeQBusiness(failureRate=1, failureCodes=('InvalidContentType',), seed=3)
+    failed = []
+    accepted = []
+    with BatchUploader(putDocuments(q_business), retries=3, backoff=0.001, onSuccess=accepted.extend, onFailure=failed.extend) as uploader:
+        uploader.submit(documents(4))
+    # Rejected documents are not retried
+    assert len(q_business.calls) == 1
+    assert not accepted
+    assert sorted(x['id'] for x in failed) == ["doc-0", "doc-1", "doc-2", "doc-3"]
+    assert uploader.failedDocuments == failed
+
+def test_uploader_fails_batches_the_service_refuses():
+    q_business = FakeQBusiness()
+    failed = []
+    with BatchUploader(putDocuments(q_business), backoff=0.001, onFailure=failed.extend) as uploader:
+        uploader.submit(documents(11))
+    assert [x['error']['errorCode'] for x in failed] == ['ValidationException'] * 11
+
+def test_uploader_deletes_by_id():
+    q_business = FakeQBusiness()
+    putDocuments(q_business)(documents(3))
+    deleted = []
+
+    def delete(ids):
+        return q_business.batch_delete_document(applicationId="app", indexId="index", documents=[{"documentId": x} for x in ids])
+
+    with BatchUploader(delete, itemId=str, onSuccess=deleted.extend, stage="delete") as deleter:
+        deleter.submit(["doc-0", "doc-2"])
+    assert deleted == ["doc-0", "doc-2"]
+    assert sorted(q_business.documents) == ["doc-1"]
+
+def test_uploader_blocks_when_the_queue_is_full():
+    release = threading.Event()
+    uploader = BatchUploader(lambda batch: release.wait() and {}, workers=1)
+    uploader.submit(documents(1))
+    uploader.submit(documents(1))
+    third = threading.Thread(target=uploader.submit, args=(documents(1),))
+    third.start()
+    third.join(0.1)
+    assert third.is_alive()
+    release.set()
+    third.join(1)
+    assert not third.is_alive()
+    uploader.close()
+
+def test_uploader_on_a_shared_executor_waits_for_its_own_batches():
+    q_business = FakeQBusiness(latency=0.05)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        uploader = BatchUploader(putDocuments(q_business), executor=executor)
+        for i in range(0, 30, 10):
+            uploader.submit(documents(30)[i:i + 10])
+        uploader.close()
+        assert len(q_business.documents) == 30
+        assert executor.submit(lambda: "running").result() == "running"
+
+@pytest.mark.parametrize("maxAge", [None, 0.01])
+def test_batcher_feeds_the_uploader(maxAge):
+    q_business = FakeQBusiness(maxCallsPerSecond=200)
+    with BatchUploader(putDocuments(q_business), retries=10, backoff=0.01) as uploader, \
+            DocumentBatcher(uploader.submit, maxAge=maxAge) as batcher:
+        for document in documents(95, 1000):
+            batcher.add(document)
+    assert len(q_business.documents) == 95
+    assert all(x['documents'] <= 10 for x in q_business.calls)
+
+def test_uploader_raises_what_its_callbacks_raise():
+    q_business = FakeQBusiness()
+
+    def onSuccess(documents):
+        raise OSError("checkpoint write failed")
+
+    uploader = BatchUploader(putDocuments(q_business), onSuccess=onSuccess)
+    uploader.submit(documents(3))
+    with pytest.raises(OSError, match="checkpoint write failed"):
+        uploader.close()
+    assert len(q_business.documents) == 3
+
+def test_uploader_on_a_shared_executor_raises_what_its_callbacks_raise():
+    def onFailure(failures):
+        raise OSError("dead letter write failed")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        uploader = BatchUploader(putDocuments(FakeQBusiness()), onFailure=onFailure, executor=executor)
+        uploader.submit(documents(11))
+        with pytest.raises(OSError, match="dead letter write failed"):
+            uploader.close()
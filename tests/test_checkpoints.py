@@ -0,0 +1,81 @@
+import pytest
+
+from common import DeadLetterQueue, HashCache, JSONCheckpointStore, MemoryCheckpointStore, SQLiteCheckpointStore, openCheckpointStore
+
+@pytest.fixture(params=["memory", "json", "sqlite"])
+def reopen(request, tmp_path):
+    # Opens the store again at the same place, like the next sync does
+    path = {"memory": None, "json": str(tmp_path / "checkpoints.json"), "sqlite": str(tmp_path / "checkpoints.db")}[request.param]
+    stores = []
+
+    def reopen(table='documents'):
+        store = openCheckpointStore(path, table)
+        stores.append(store)
+        return store
+
+    reopen.persistent = path is not None
+    yield reopen
+    for store in stores:
+        store.close()
+
+def test_open_picks_the_store_by_path(tmp_path):
+    assert type(openCheckpointStore(None)) is MemoryCheckpointStore
+    assert type(openCheckpointStore(str(tmp_path / "a.json"))) is JSONCheckpointStore
+    assert type(openCheckpointStore(str(tmp_path / "a.db"))) is SQLiteCheckpointStore
+
+def test_store_remembers_versions_and_cursors(reopen):
+    store = reopen()
+    store.putMany([("a", "1"), ("b", "2")])
+    store.put("a", "3")
+    store.remove(["b", "missing"])
+    store.setCursor("delta", {"token": "abc"})
+    assert store.get("a") == "3"
+    assert store.get("b") is None
+    assert store.ids() == {"a"}
+    assert store.getCursor("delta") == {"token": "abc"}
+    assert store.getCursor("other") is None
+
+def test_store_keeps_progress_across_syncs(reopen):
+    store = reopen()
+    store.putMany([("a", "1")])
+    store.setCursor("delta", "abc")
+    store.close()
+    store = reopen()
+    if reopen.persistent:
+        assert (store.get("a"), store.getCursor("delta")) == ("1", "abc")
+    else:
+        assert (store.get("a"), store.getCursor("delta")) == (None, None)
+
+def test_tables_are_kept_apart(reopen):
+    documents, hashes = reopen(), reopen('hashes')
+    documents.put("a", "1")
+    hashes.put("b", "2")
+    assert documents.ids() == {"a"}
+    assert hashes.ids() == {"b"}
+
+def test_hash_cache_stores_digest_and_etag(reopen):
+    cache = HashCache(reopen('hashes'))
+    cache.putMany([("a", "digest", '"etag"')])
+    assert cache.get("a") == ["digest", '"etag"']
+    assert cache.get("b") == (None, None)
+    cache.remove(["a"])
+    assert cache.get("a") == (None, None)
+
+def test_dead_letters_survive_an_interrupted_replay(tmp_path):
+    queue = DeadLetterQueue(str(tmp_path / "dead.jsonl"))
+    assert queue.take() == []
+    queue.add("fetch", "a", {"name": "a"}, ValueError("first"), True)
+    queue.add("upload", "a", {"name": "a"}, "second", True)
+    queue.add("upload", "b", None, "rejected", False)
+    entries = {x['id']: x for x in queue.take()}
+    assert entries['a']['stage'] == "upload"
+    assert entries['a']['error'] == "second"
+    assert entries['b']['retryable'] is False
+
+    # Taken but not replayed, then failing again during the next replay
+    queue.add("fetch", "c", {"name": "c"}, ValueError("third"), True)
+    entries = {x['id']: x for x in queue.take()}
+    assert sorted(entries) == ["a", "b", "c"]
+    assert entries['c']['errorType'] == "ValueError"
+    queue.replayed()
+    assert queue.take() == []
@@ -0,0 +1,51 @@
+import struct
+
+import pytest
+
+from common import BufferReader, DocumentBuffer, DocumentTooLarge, FrameReader, contentDigest
+
+def frame(name, content, status=0):
+    name = name.encode()
+    return struct.pack(">I", len(name)) + name + struct.pack(">BQ", status, len(content)) + content
+
+def chunked(data, size):
+    return iter([data[i:i + size] for i in range(0, len(data), size)])
+
+BODY = frame("a.txt", b"hello") + frame("missing.txt", b"Document not found.", 1) + frame("", b"") + frame("b.txt", b"x" * 100)
+
+@pytest.mark.parametrize("size", [1, 3, 7, len(BODY)])
+def test_frames_split_across_chunks(size):
+    frames = [(name, status, length, b"".join(content)) for name, status, length, content in FrameReader(chunked(BODY, size))]
+    assert frames == [
+        ("a.txt", 0, 5, b"hello"),
+        ("missing.txt", 1, 19, b"Document not found."),
+        ("", 0, 0, b""),
+        ("b.txt", 0, 100, b"x" * 100)]
+
+def test_unread_content_is_skipped():
+    names = [name for name, status, size, content in FrameReader(chunked(BODY, 4))]
+    assert names == ["a.txt", "missing.txt", "", "b.txt"]
+
+def test_truncated_frame_raises():
+    with pytest.raises(ValueError):
+        for name, status, size, content in FrameReader(chunked(BODY[:-10], 16)):
+            b"".join(content)
+
+def test_buffer_spools_large_content_to_a_file():
+    buffer = DocumentBuffer(spoolBytes=10)
+    buffer.write(b"0123456789")
+    assert buffer.file is None
+    buffer.write(b"abcdef")
+    assert buffer.file is not None
+    assert len(buffer) == 16
+    assert buffer.getvalue() == b"0123456789abcdef"
+    assert buffer.readAt(8, 4) == b"89ab"
+    assert buffer.hexdigest() == contentDigest(b"0123456789abcdef")
+    reader = BufferReader(buffer)
+    assert [reader.read(5) for _ in range(4)] == [b"01234", b"56789", b"abcde", b"f"]
+
+def test_buffer_refuses_documents_over_the_limit():
+    buffer = DocumentBuffer(maxBytes=10)
+    buffer.write(b"0123456789")
+    with pytest.raises(DocumentTooLarge):
+        buffer.write(b"a")
@@ -0,0 +1,57 @@
+from common import Document, generic_connector
+
+class SplittingConnector(generic_connector):
+    transformers = [("split", {"max_bytes": 10})]
+
+    def sync(self, documents):
+        # documents maps names to (version, text)
+        changed = [(name, Document(name, text.encode(), contentType="PLAIN_TEXT"))
+            for name, (version, text) in documents.items() if self.documentChanged(name, version)]
+        with self.documentUploader() as uploader, self.documentBatcher(uploader.submit) as batch:
+            for result in self.transformDocuments(changed):
+                for document in result.documents:
+                    batch.add(document)
+        self.deleteMissingDocuments(set(documents))
+        return self
+
+def indexed(q_business, connector):
+    # Ids in the index and in the checkpoint
+    return sorted(q_business.documents), sorted(connector.checkpoints.ids())
+
+def test_parts_a_document_no_longer_has_are_deleted(makeConnector, q_business):
+    line = "123456789\n"
+    parts = ["big.txt#part-1", "big.txt#part-2", "big.txt#part-3", "big.txt#part-4"]
+    connector = makeConnector(SplittingConnector).sync({"big.txt": ("1", line * 4), "small.txt": ("1", "small")})
+    assert indexed(q_business, connector) == (parts + ["small.txt"], ["big.txt"] + parts + ["small.txt"])
+
+    connector = makeConnector(SplittingConnector).sync({"big.txt": ("2", line * 2), "small.txt": ("1", "small")})
+    assert indexed(q_business, connector) == (parts[:2] + ["small.txt"], ["big.txt"] + parts[:2] + ["small.txt"])
+
+    connector = makeConnector(SplittingConnector).sync({"big.txt": ("3", "short"), "small.txt": ("1", "small")})
+    assert indexed(q_business, connector) == (["big.txt", "small.txt"], ["big.txt", "small.txt"])
+
+def test_unchanged_split_document_keeps_its_parts(makeConnector, q_business):
+    makeConnector(SplittingConnector).sync({"big.txt": ("1", "123456789\n" * 3)})
+    makeConnector(SplittingConnector).sync({"big.txt": ("1", "123456789\n" * 3)})
+    assert sorted(q_business.documents) == ["big.txt#part-1", "big.txt#part-2", "big.txt#part-3"]
+
+def test_parts_go_with_their_parent(makeConnector, q_business):
+    makeConnector(SplittingConnector).sync({"big.txt": ("1", "123456789\n" * 3), "small.txt": ("1", "small")})
+    connector = makeConnector(SplittingConnector).sync({"small.txt": ("1", "small")})
+    assert indexed(q_business, connector) == (["small.txt"], ["small.txt"])
+    assert connector.partCounts.get("big.txt") is None
+
+def test_failed_part_deletion_is_retried_by_the_next_sync(makeConnector, q_business):
+    makeConnector(SplittingConnector).sync({"big.txt": ("1", "123456789\n" * 3)})
+    connector = makeConnector(SplittingConnector)
+    delete = q_business.batch_delete_document
+
+    def failingDelete(**kwargs):
+        raise RuntimeError("unavailable")
+
+    q_business.batch_delete_document = failingDelete
+    connector.sync({"big.txt": ("2", "short")})
+    assert sorted(q_business.documents) == ["big.txt", "big.txt#part-1", "big.txt#part-2", "big.txt#part-3"]
+    q_business.batch_delete_document = delete
+    makeConnector(SplittingConnector).sync({"big.txt": ("2", "short")})
+    assert sorted(q_business.documents) == ["big.txt"]
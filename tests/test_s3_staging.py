@@ -0,0 +1,76 @@
+import struct
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from common import Document, DocumentBuffer, S3Location
+
+BIG = b"b" * 3000
+SMALL = b"small"
+STAGING = {"s3_bucket": "staging", "s3_threshold": "1000", "s3_role_arn": "arn:aws:iam::123456789012:role/qbusiness"}
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket="staging")
+        yield client
+
+def sync(connector, results):
+    with connector.documentUploader() as uploader, connector.documentBatcher(uploader.submit) as batch:
+        for result in results:
+            assert result.error is None
+            batch.add(Document(result.key, result.content, title=result.key))
+    return uploader
+
+def fetch(connector, source, names):
+    return connector.fetchDocuments(((name, f"{source.url}/{name}") for name in names), getId=lambda name: name)
+
+def frame(name, content):
+    return struct.pack(">I", len(name)) + name.encode() + struct.pack(">BQ", 0, len(content)) + content
+
+def test_bucket_without_role_is_rejected(s3, makeConnector):
+    with pytest.raises(ValueError, match="s3_role_arn"):
+        makeConnector(s3_bucket="staging")
+
+def test_large_documents_are_staged_and_uploaded_by_reference(s3, source, makeConnector, q_business):
+    connector = makeConnector(**STAGING)
+    source.script("/big", (200, BIG, {}))
+    source.script("/small", (200, SMALL, {}))
+    results = list(fetch(connector, source, ["big", "small"]))
+    assert isinstance(results[0].content, S3Location)
+    assert isinstance(results[1].content, DocumentBuffer)
+    assert s3.get_object(Bucket="staging", Key="big")["Body"].read() == BIG
+
+    # FakeQBusiness rejects S3 content sent without a roleArn
+    uploader = sync(connector, results)
+    assert not uploader.failedDocuments
+    assert q_business.documents["big"]["s3"] == {"bucket": "staging", "key": "big"}
+    assert q_business.documents["small"]["bytes"] == len(SMALL)
+
+def test_unchanged_documents_are_not_staged_again(s3, source, makeConnector):
+    source.script("/big", (200, BIG, {}), (200, BIG, {}))
+    first = makeConnector(**STAGING)
+    sync(first, fetch(first, source, ["big"]))
+    assert first.metrics.snapshot()["counters"]["s3.documents"] == 1
+
+    s3.delete_object(Bucket="staging", Key="big")
+    second = makeConnector(**STAGING)
+    assert list(fetch(second, source, ["big"])) == []
+    counters = second.metrics.snapshot()["counters"]
+    assert counters["fetch.unchanged"] == 1
+    assert "s3.documents" not in counters
+    assert "Contents" not in s3.list_objects_v2(Bucket="staging")
+
+def test_bulk_fetch_stages_large_documents(s3, source, makeConnector):
+    connector = makeConnector(**STAGING, s3_prefix="bulk/")
+    source.script("/getDocs?name=big&name=small", (200, frame("big", BIG) + frame("small", SMALL), {}))
+    results = {result.key: result.content
+        for result in connector.fetchDocumentsBulk([("big", "big"), ("small", "small")], f"{source.url}/getDocs", batchSize=2)}
+    assert isinstance(results["big"], S3Location) and results["big"].key == "bulk/big"
+    assert bytes(results["small"].getvalue()) == SMALL
+    assert s3.get_object(Bucket="staging", Key="bulk/big")["Body"].read() == BIG
@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import pytest
+import requests
+
+from common import CircuitBreaker, CircuitOpenError, RetryBudget, SourcePolicy
+from async_common import async_generic_connector, iterate
+
+def test_breaker_opens_after_threshold_and_lets_one_trial_through():
+    breaker = CircuitBreaker("host", threshold=2, resetSeconds=0.1)
+    assert breaker.allow() is None
+    breaker.failure()
+    breaker.failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    time.sleep(0.15)
+    probe = breaker.allow()
+    assert probe is not None
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.success()
+    assert breaker.allow() is None
+
+def test_released_trial_lets_the_next_request_try():
+    breaker = CircuitBreaker("host", threshold=1, resetSeconds=0.1)
+    breaker.failure()
+    time.sleep(0.15)
+    stale = breaker.allow()
+    breaker.failure()
+    time.sleep(0.15)
+    probe = breaker.allow()
+    # The first trial failed and reopened the circuit, its release must not
+    # clear the trial that is under way now
+    breaker.release(stale)
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.release(probe)
+    assert breaker.allow() is not None
+
+def test_retry_budget_caps_retries():
+    policy = SourcePolicy(retries=3, backoff=0.01, budget=RetryBudget(0.1, minimum=5), breakerThreshold=100)
+    retries = 0
+    while policy.retryDelay("http://host/a", 0, status=503) is not None:
+        retries += 1
+    assert retries == 5
+
+def test_throttled_trial_does_not_leave_the_circuit_open(source, makeConnector):
+    connector = makeConnector(breaker_threshold="2", breaker_reset_seconds="0.2",
+        source_retries="0", throttle_retries="1")
+    url = source.url + "/doc"
+    source.script("/doc", 500, 500, 500, 503)
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            connector.sourceRequest("token", url, {})
+    with pytest.raises(CircuitOpenError):
+        connector.sourceRequest("token", url, {})
+    time.sleep(0.25)
+    with pytest.raises(requests.HTTPError):
+        connector.sourceRequest("token", url, {})
+    time.sleep(0.25)
+    # The trial is throttled, then answered
+    assert connector.sourceRequest("token", url, {}).content == b"/doc"
+    breaker = connector.sourcePolicy.breaker(url)
+    assert breaker.openedAt is None and not breaker.probing
+    assert connector.sourceRequest("token", url, {}).content == b"/doc"
+
+def test_request_keeps_retrying_after_its_failures_open_the_circuit(source, makeConnector):
+    connector = makeConnector(breaker_threshold="2", source_retries="3", throttle_retries="0")
+    source.script("/doc", 500, 500)
+    assert connector.sourceRequest("token", source.url + "/doc", {}).content == b"/doc"
+    assert connector.metrics.snapshot()["counters"]["source.retries"] == 2
+
+def test_body_cut_off_midway_is_retried(source, makeConnector):
+    connector = makeConnector()
+    source.script("/doc", (200, source.TRUNCATED, {}))
+    [result] = connector.fetchDocuments([("doc", source.url + "/doc")])
+    assert result.error is None
+    assert result.content.getvalue() == b"/doc"
+    counters = connector.metrics.snapshot()["counters"]
+    assert counters["source.retries"] == 1
+    assert counters["source.requests"] == 2
+
+def test_body_cut_off_midway_is_retried_async(source, makeConnector):
+    import aiohttp
+
+    connector = makeConnector(async_generic_connector)
+    source.script("/doc", (200, source.TRUNCATED, {}))
+
+    async def fetch():
+        async with aiohttp.ClientSession() as connector.client:
+            return [result async for result in connector.fetchDocuments(iterate([("doc", source.url + "/doc")]))]
+
+    [result] = asyncio.run(fetch())
+    assert result.error is None
+    assert result.content.getvalue() == b"/doc"
+    assert connector.metrics.snapshot()["counters"]["source.retries"] == 1
@@ -0,0 +1,124 @@
+import os
+import json
+import threading
+from importlib.machinery import SourceFileLoader
+from importlib.util import module_from_spec, spec_from_loader
+
+import boto3
+import pytest
+from werkzeug.serving import make_server
+
+from fake_qbusiness import FakeQBusiness
+
+WORKSHOP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples", "workshop")
+DOCUMENTS = [f"doc-{i:02}.pdf" for i in range(23)]
+
+def loadModule(name, path):
+    # Loads a script that is not a package module, like connector.py.complete
+    spec = spec_from_loader(name, SourceFileLoader(name, path))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class OutOfTimeAfter:
+    # Lambda context with time for the given number of documents
+    def __init__(self, documents):
+        self.documents = documents
+
+    def get_remaining_time_in_millis(self):
+        self.documents -= 1
+        return 15 * 60 * 1000 if self.documents >= 0 else 0
+
+@pytest.fixture
+def workshop(tmp_path, monkeypatch):
+    # The datasource server over DOCUMENTS and the completed connector, with
+    # boto3 handing out a FakeQBusiness
+    for name in DOCUMENTS:
+        (tmp_path / name).write_bytes(name.encode())
+    monkeypatch.setenv("DOCUMENTS_DIR", str(tmp_path))
+    datasource = loadModule("workshop_datasource", os.path.join(WORKSHOP, "datasource", "server.py"))
+    server = make_server("127.0.0.1", 0, datasource.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    url = f"http://127.0.0.1:{server.server_port}"
+    for name, value in {
+            "Q_APPLICATION_ID": "app",
+            "Q_INDEX_ID": "index",
+            "Q_DATASOURCE_ID": "source",
+            "OAUTH2_CLIENT_ID": "client",
+            "OAUTH2_SECRET": "secret",
+            "OAUTH2_TOKEN_URL": url + "/oauth/token",
+            "GENERIC_DATASOURCE_URL": url,
+            "RATE_LIMIT": "1000",
+            "SELF_INVOKE": "false"}.items():
+        monkeypatch.setenv(name, value)
+    q_business = FakeQBusiness()
+    monkeypatch.setattr(boto3, "client", lambda service: q_business)
+    connector = loadModule("workshop_connector", os.path.join(WORKSHOP, "connector", "connector.py.complete"))
+    yield connector, q_business
+    server.shutdown()
+    server.server_close()
+
+def uploadedOnce(q_business):
+    return sorted(q_business.documents) == DOCUMENTS and all(x['versions'] == 1 for x in q_business.documents.values())
+
+@pytest.mark.parametrize("shardCount", [1, 4, 30])
+def test_sharded_sync_ingests_every_document_once(workshop, shardCount):
+    connector, q_business = workshop
+    job = connector.run_sharded_sync_locally(shardCount)
+    assert len(job['shards']) == min(shardCount, len(DOCUMENTS))
+    assert uploadedOnce(q_business)
+    assert q_business.jobs[job['job_execution_id']]['status'] == 'STOPPED'
+
+def test_worker_out_of_time_carries_on_from_its_position(workshop):
+    connector, q_business = workshop
+    job = connector.lambda_handler({"action": "start", "shard_count": 2}, None)
+    positions = []
+    for shard in job['shards']:
+        while shard['position'] is not None:
+            shard = connector.lambda_handler(shard, OutOfTimeAfter(5))
+            positions.append(shard['position'])
+    connector.lambda_handler({"action": "stop", "job_execution_id": job['job_execution_id']}, None)
+    # Each shard of 12 or 11 documents takes three invocations
+    assert len(positions) == 6
+    assert uploadedOnce(q_business)
+
+def test_continuation_resumes_the_same_job(workshop):
+    connector, q_business = workshop
+    result = connector.lambda_handler({}, OutOfTimeAfter(10))
+    continuation = result['continuation']
+    assert q_business.jobs[continuation['job_execution_id']]['status'] == 'SYNCING'
+    while result['continuation'] is not None:
+        result = connector.lambda_handler({"continuation": result['continuation']}, OutOfTimeAfter(10))
+    assert len(q_business.jobs) == 1
+    assert q_business.jobs[continuation['job_execution_id']]['status'] == 'STOPPED'
+    assert uploadedOnce(q_business)
+
+def test_worker_without_time_to_work_in_fails(workshop):
+    connector, q_business = workshop
+    job = connector.lambda_handler({"action": "start", "shard_count": 1}, None)
+    with pytest.raises(RuntimeError):
+        connector.lambda_handler(job['shards'][0], OutOfTimeAfter(0))
+
+def test_listing_pages_from_one_snapshot(tmp_path, monkeypatch):
+    for i, name in enumerate(DOCUMENTS):
+        (tmp_path / name).write_bytes(name.encode())
+        os.utime(tmp_path / name, (1000 + i, 1000 + i))
+    monkeypatch.setenv("DOCUMENTS_DIR", str(tmp_path))
+    datasource = loadModule("workshop_datasource", os.path.join(WORKSHOP, "datasource", "server.py"))
+    client = datasource.app.test_client()
+    token = json.loads(client.post("/oauth/token", data={"client_id": "c", "client_secret": "s"}).data)
+    headers = {"Authorization": "Bearer " + token['access_token']}
+    names = []
+    query = {"limit": 4, "modifiedSince": 1009.5}
+    while True:
+        page = json.loads(client.get("/getListDocs", query_string=query, headers=headers).data)
+        names += [x['name'] for x in page['documents']]
+        if not page['nextCursor']:
+            break
+        query["cursor"] = page['nextCursor']
+        # Files added after the first page only show up at the end
+        (tmp_path / f"new-{len(names)}.pdf").write_bytes(b"new")
+    assert names[:13] == DOCUMENTS[10:]
+    assert all(x.startswith("new-") for x in names[13:])